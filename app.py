@@ -1,26 +1,361 @@
 import os
-from flask import Flask, request, abort, jsonify
+from datetime import date, datetime, timedelta
+from flask import Flask, Response, request, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm.exc import StaleDataError
+
+from models import db, Actor, Movie, MovieRole, setup_db, bulk_insert, bulk_delete, insert_role, statement_timeout
+from auth.auth import AuthError, requires_auth, check_permissions
+from pagination import ITEMS_PER_PAGE, MAX_ITEMS_PER_PAGE, paginate_query
+from caching import response_cache, conditional
+from idempotency import idempotency_store
+from replicas import read_only
+from catalog import EXPORT_STATEMENT_TIMEOUT, iter_export, parse_entity_types, parse_updated_since
+from graph import casting_graph, record_deletes, record_roles
+from search import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, SEARCH_TYPES, parse_search_types, search_index
+from stats import stats_cache
+from serialization import jsonify, init_app as init_json
+from metrics import METRICS_ENABLED, timed, init_app as init_metrics
+
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 1000))
+BULK_ATOMIC = os.getenv('BULK_ATOMIC', 'false').lower() == 'true'
+
+def validate_actor(body):
+  if not body.get('name', None):
+    return 'Missing name'
+  if not body.get('age', None):
+    return 'Missing age'
+  if not body.get('gender', None):
+    return 'Missing gender'
+
+def validate_movie(body):
+  if not body.get('title', None):
+    return 'Missing title'
+  if not body.get('release_date', None):
+    return 'Missing release date'
+
+def parse_text(value):
+  if not isinstance(value, str):
+    raise TypeError(value)
+  return value
+
+# Integers that fit the database's INTEGER columns; numeric strings are accepted
+def parse_integer(value):
+  if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+    raise ValueError(value)
+  value = int(value)
+  if not -2 ** 31 <= value < 2 ** 31:
+    raise ValueError(value)
+  return value
+
+# ISO 8601 dates, e.g. 2021-07-01, with an optional time
+def parse_release_date(value):
+  return datetime.fromisoformat(parse_text(value))
+
+FIELD_PARSERS = {
+  'id': parse_integer,
+  'name': parse_text,
+  'age': parse_integer,
+  'gender': parse_text,
+  'title': parse_text,
+  'release_date': parse_release_date,
+  'actor_id': parse_integer,
+  'movie_id': parse_integer,
+  'version': parse_integer
+}
+
+# Converts the given fields of a request item to the types of their columns,
+# leaving out the missing ones. Returns the values, or an error message for
+# the first value that does not fit.
+def parse_fields(item, fields):
+  values = {}
+  for field in fields:
+    if item.get(field, None) is not None:
+      try:
+        values[field] = FIELD_PARSERS[field](item[field])
+      except (TypeError, ValueError):
+        return None, 'Invalid ' + field
+  return values, None
+
+def get_bulk_items(request):
+  items = request.get_json()
+
+  if not isinstance(items, list):
+    return None, 'Expected a list of items'
+  if len(items) > BULK_MAX_ITEMS:
+    return None, 'Too many items, the maximum is ' + str(BULK_MAX_ITEMS)
+
+  return items, None
+
+# Reads the comma separated fields= and include= query parameters for a model.
+# Without them the full representation is returned; include= with no value
+# leaves out every relationship. The id is always part of the response.
+def get_fieldset(request, model):
+  fields = model.FIELDS
+  include = model.RELATIONSHIPS
+
+  if 'fields' in request.args:
+    requested = set(filter(None, request.args['fields'].split(',')))
+    if not requested or not requested.issubset(model.FIELDS):
+      abort(400)
+    fields = [field for field in model.FIELDS if field == 'id' or field in requested]
+
+  if 'include' in request.args:
+    include = set(filter(None, request.args['include'].split(',')))
+    if not include.issubset(model.RELATIONSHIPS):
+      abort(400)
+
+  return fields, include
+
+# Reads sort=<column> or sort=-<column> (descending) for a listing. Ties are
+# broken by id so the order, and the cursors taken from it, are stable.
+def get_sort(request, model):
+  sort = request.args.get('sort', None) or 'id'
+  descending = sort.startswith('-')
+  key = sort[1:] if descending else sort
+
+  if key not in model.SORTABLE:
+    abort(400)
+
+  columns = [getattr(model, key)]
+  if key != 'id':
+    columns.append(model.id)
+  return columns, descending
+
+def get_arg(request, name, type):
+  value = request.args.get(name, None)
+  if value is None or value == '':
+    return None
+
+  try:
+    return type(value)
+  except ValueError:
+    abort(400)
+
+# Maps each of the ids that exist to the given column, in one query
+def get_names(model, column, ids):
+  if not ids:
+    return {}
+  return dict(db.session.query(model.id, column).filter(model.id.in_(set(ids))))
+
+def escape_like(value):
+  return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def filter_actors(request, query):
+  name = get_arg(request, 'name', str)
+  min_age = get_arg(request, 'min_age', int)
+  max_age = get_arg(request, 'max_age', int)
+  gender = get_arg(request, 'gender', str)
+
+  if name is not None:
+    query = query.filter(Actor.name.like(escape_like(name) + '%', escape='\\'))
+  if min_age is not None:
+    query = query.filter(Actor.age >= min_age)
+  if max_age is not None:
+    query = query.filter(Actor.age <= max_age)
+  if gender is not None:
+    query = query.filter(Actor.gender == gender)
+  return query
+
+# Release date bounds are whole days and both inclusive
+def filter_movies(request, query):
+  title = get_arg(request, 'title', str)
+  min_release_date = get_arg(request, 'min_release_date', date.fromisoformat)
+  max_release_date = get_arg(request, 'max_release_date', date.fromisoformat)
+
+  if title is not None:
+    query = query.filter(Movie.title.ilike('%' + escape_like(title) + '%', escape='\\'))
+  if min_release_date is not None:
+    query = query.filter(Movie.release_date >= datetime.combine(min_release_date, datetime.min.time()))
+  if max_release_date is not None:
+    query = query.filter(Movie.release_date < datetime.combine(max_release_date + timedelta(days=1), datetime.min.time()))
+  return query
+
+# Parses and validates each item of a bulk request and inserts the valid ones
+# with a single statement and commit. Validation sees the parsed values. With
+# atomic=true (or BULK_ATOMIC) a single invalid item rejects the whole batch.
+def bulk_create(request, model, items, validate, fields):
+  atomic = request.args.get('atomic', str(BULK_ATOMIC)).lower() == 'true'
+  results = []
+  rows = []
+
+  for index, item in enumerate(items):
+    row, error = parse_fields(item, fields) if isinstance(item, dict) else (None, 'Invalid item')
+    error = error or validate(row)
+    if error:
+      results.append({'index': index, 'error': 422, 'message': error})
+    else:
+      results.append({'index': index})
+      rows.append({field: row[field] for field in fields})
+
+  if atomic and len(rows) < len(items):
+    return jsonify({
+      'success': False,
+      'error': 422,
+      'message': 'Batch rejected',
+      'results': results
+    }), 422
 
-from models import db, Actor, Movie, MovieRole, setup_db
-from auth.auth import AuthError, requires_auth
-
-ITEMS_PER_PAGE = 10
+  try:
+    ids = bulk_insert(model, rows)
+    if model is MovieRole:
+      record_roles(db.session, [(row['actor_id'], row['movie_id']) for row in rows])
+    db.session.commit()
+  except:
+    db.session.rollback()
+    abort(422)
+
+  created = iter(ids)
+  for result in results:
+    if 'error' not in result:
+      result['id'] = next(created)
+
+  return jsonify({
+    'success': True,
+    'created': len(ids),
+    'results': results
+  }), 200
+
+# Applies a list of {id, <fields>, version} patches with one IN query to load
+# the targets and a single commit. Items for a missing id, or whose optional
+# version no longer matches, are reported and left out; with atomic=true (or
+# BULK_ATOMIC) any such item rejects the whole batch.
+def bulk_update(request, model, items, fields):
+  atomic = request.args.get('atomic', str(BULK_ATOMIC)).lower() == 'true'
+  results = []
+  patches = []
+
+  for index, item in enumerate(items):
+    values, error = parse_fields(item, ('id', 'version') + fields) if isinstance(item, dict) else (None, 'Missing id')
+    if error:
+      results.append({'index': index, 'error': 422, 'message': error})
+    elif 'id' not in values:
+      results.append({'index': index, 'error': 422, 'message': 'Missing id'})
+    elif not any(field in values for field in fields):
+      results.append({'index': index, 'id': values['id'], 'error': 422, 'message': 'Nothing to update'})
+    else:
+      results.append({'index': index, 'id': values['id']})
+      patches.append((results[-1], values))
+
+  targets = {}
+  ids = {item['id'] for _, item in patches}
+  if ids:
+    targets = {target.id: target for target in model.query.filter(model.id.in_(ids))}
+
+  updated = {}
+  for result, item in patches:
+    target = targets.get(item['id'])
+    if target is None:
+      result.update(error=404, message='No item could be found for id ' + str(item['id']))
+    elif 'version' in item and item['version'] != target.version:
+      result.update(error=409, message='Version conflict', version=target.version)
+    elif target.id in updated:
+      result.update(error=422, message='Duplicate id')
+    else:
+      for field in fields:
+        if field in item:
+          setattr(target, field, item[field])
+      updated[target.id] = target
+
+  if atomic and len(updated) < len(items):
+    db.session.rollback()
+    return jsonify({
+      'success': False,
+      'error': 422,
+      'message': 'Batch rejected',
+      'results': results
+    }), 422
 
-def paginate_items(request, items):
-  page = request.args.get('page', 1, type=int)
-  start = (page - 1) * ITEMS_PER_PAGE
-  end = page * ITEMS_PER_PAGE
+  # A row changed by another request since it was loaded fails the flush,
+  # and then nothing in the batch is written
+  try:
+    db.session.flush()
+    versions = {id: target.version for id, target in updated.items()}
+    db.session.commit()
+  except StaleDataError:
+    db.session.rollback()
+    return jsonify({
+      'success': False,
+      'error': 409,
+      'message': 'Concurrent update, retry the batch'
+    }), 409
+  except:
+    db.session.rollback()
+    abort(422)
+
+  for result in results:
+    if 'error' not in result:
+      result['version'] = versions[result['id']]
+
+  return jsonify({
+    'success': True,
+    'updated': len(updated),
+    'results': results
+  }), 200
+
+# Deletes a list of ids with a single statement and commit, the database
+# removing their movie roles. Ids that do not exist are reported; with
+# atomic=true (or BULK_ATOMIC) they reject the whole batch.
+def bulk_destroy(request, model, items):
+  atomic = request.args.get('atomic', str(BULK_ATOMIC)).lower() == 'true'
+  parsed = []
+  for item in items:
+    try:
+      parsed.append(parse_integer(item))
+    except (TypeError, ValueError):
+      parsed.append(None)
+  ids = {item for item in parsed if item is not None}
+
+  try:
+    deleted = set(bulk_delete(model, ids))
+  except:
+    db.session.rollback()
+    abort(422)
+
+  results = []
+  seen = set()
+  for index, item in enumerate(parsed):
+    if item is None:
+      results.append({'index': index, 'error': 422, 'message': 'Invalid id'})
+    elif item not in deleted:
+      results.append({'index': index, 'id': item, 'error': 404, 'message': 'No item could be found for id ' + str(item)})
+    elif item in seen:
+      results.append({'index': index, 'id': item, 'error': 422, 'message': 'Duplicate id'})
+    else:
+      results.append({'index': index, 'id': item})
+    seen.add(item)
+
+  if atomic and any('error' in result for result in results):
+    db.session.rollback()
+    return jsonify({
+      'success': False,
+      'error': 422,
+      'message': 'Batch rejected',
+      'results': results
+    }), 422
 
-  formatted_items = [item.format() for item in items]
+  try:
+    record_deletes(db.session, model, deleted)
+    db.session.commit()
+  except:
+    db.session.rollback()
+    abort(422)
 
-  return formatted_items[start:end]
+  return jsonify({
+    'success': True,
+    'deleted': len(deleted),
+    'results': results
+  }), 200
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
   setup_db(app)
+  init_json(app)
+  if METRICS_ENABLED:
+    init_metrics(app)
 
   cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
 
@@ -32,17 +367,26 @@ def create_app(test_config=None):
 
   @app.route('/actors', methods=['GET'])
   @requires_auth('get:actors')
+  @read_only
+  @conditional('Actor', 'Movie', 'MovieRole')
+  @response_cache.cached('Actor', 'Movie', 'MovieRole')
   def get_actors(payload):
-    actors = Actor.query.order_by(Actor.id).all()
-    selected_actors = paginate_items(request, actors)
+    fields, include = get_fieldset(request, Actor)
+    columns, descending = get_sort(request, Actor)
+    query = filter_actors(request, Actor.load_query(set(fields) | {columns[0].key}, include))
+    actors, pagination = paginate_query(request, query, columns, descending)
 
-    if not selected_actors or len(selected_actors) < 1:
+    if not actors or len(actors) < 1:
       abort(404)
     
     try:
+      with timed('format'):
+        actors = [actor.format(fields, include) for actor in actors]
+
       return jsonify({
         'success': True,
-        'actors': selected_actors
+        'actors': actors,
+        **pagination
       }), 200
 
     except:
@@ -50,22 +394,71 @@ def create_app(test_config=None):
 
   @app.route('/movies', methods=['GET'])
   @requires_auth('get:movies')
+  @read_only
+  @conditional('Actor', 'Movie', 'MovieRole')
+  @response_cache.cached('Actor', 'Movie', 'MovieRole')
   def get_movies(payload):
-    movies = Movie.query.order_by(Movie.id).all()
-    selected_movies = paginate_items(request, movies)
+    fields, include = get_fieldset(request, Movie)
+    columns, descending = get_sort(request, Movie)
+    query = filter_movies(request, Movie.load_query(set(fields) | {columns[0].key}, include))
+    movies, pagination = paginate_query(request, query, columns, descending)
 
-    if not selected_movies or len(selected_movies) < 1:
+    if not movies or len(movies) < 1:
       abort(404)
     
     try:
+      with timed('format'):
+        movies = [movie.format(fields, include) for movie in movies]
+
       return jsonify({
         'success': True,
-        'movies': selected_movies
+        'movies': movies,
+        **pagination
       }), 200
 
     except:
       abort(422)
 
+  @app.route('/actors/<int:actor_id>', methods=['GET'])
+  @requires_auth('get:actors')
+  @read_only
+  @conditional('Actor', 'Movie', 'MovieRole')
+  @response_cache.cached('Actor', 'Movie', 'MovieRole')
+  def get_actor(payload, actor_id):
+    fields, include = get_fieldset(request, Actor)
+    actor = Actor.load_query(fields, include).filter(Actor.id == actor_id).one_or_none()
+
+    if actor is None:
+      abort(404)
+
+    with timed('format'):
+      actor = actor.format(fields, include)
+
+    return jsonify({
+      'success': True,
+      'actor': actor
+    }), 200
+
+  @app.route('/movies/<int:movie_id>', methods=['GET'])
+  @requires_auth('get:movies')
+  @read_only
+  @conditional('Actor', 'Movie', 'MovieRole')
+  @response_cache.cached('Actor', 'Movie', 'MovieRole')
+  def get_movie(payload, movie_id):
+    fields, include = get_fieldset(request, Movie)
+    movie = Movie.load_query(fields, include).filter(Movie.id == movie_id).one_or_none()
+
+    if movie is None:
+      abort(404)
+
+    with timed('format'):
+      movie = movie.format(fields, include)
+
+    return jsonify({
+      'success': True,
+      'movie': movie
+    }), 200
+
   @app.route('/actors/<int:actor_id>', methods=['DELETE'])
   @requires_auth('delete:actors')
   def delete_actor(payload, actor_id):
@@ -106,33 +499,20 @@ def create_app(test_config=None):
 
   @app.route('/actors', methods=['POST'])
   @requires_auth('post:actors')
+  @idempotency_store.idempotent
   def new_actor(payload):
     body = request.get_json()
-    name = body.get('name', None)
-    age = body.get('age', None)
-    gender = body.get('gender', None)
-
-    if not name:
-      return jsonify({
-        'success': False,
-        "error": 422,
-        'message': 'Missing name'
-      }), 422
-    if not age:
-      return jsonify({
-        'success': False,
-        "error": 422,
-        'message': 'Missing age'
-      }), 422
-    if not gender:
+    values, error = parse_fields(body, ('name', 'age', 'gender'))
+    error = error or validate_actor(values)
+    if error:
       return jsonify({
         'success': False,
         "error": 422,
-        'message': 'Missing gender'
+        'message': error
       }), 422
       
     try:
-      actor = Actor(name=name, age=age, gender=gender)
+      actor = Actor(**values)
       actor.insert()
 
       return jsonify({
@@ -145,26 +525,20 @@ def create_app(test_config=None):
 
   @app.route('/movies', methods=['POST'])
   @requires_auth('post:movies')
+  @idempotency_store.idempotent
   def new_movie(payload):
     body = request.get_json()
-    title = body.get('title', None)
-    release_date = body.get('release_date', None)
-
-    if not title:
-      return jsonify({
-        'success': False,
-        "error": 422,
-        'message': 'Missing title'
-      }), 422
-    if not release_date:
+    values, error = parse_fields(body, ('title', 'release_date'))
+    error = error or validate_movie(values)
+    if error:
       return jsonify({
         'success': False,
         "error": 422,
-        'message': 'Missing release date'
+        'message': error
       }), 422
 
     try:
-      movie = Movie(title=title, release_date=release_date)
+      movie = Movie(**values)
       movie.insert()
 
       return jsonify({
@@ -184,19 +558,20 @@ def create_app(test_config=None):
       abort(404)
 
     body = request.get_json()
-    name = body.get('name', None)
-    age = body.get('age', None)
-    gender = body.get('gender', None)
+    values, error = parse_fields(body, ('name', 'age', 'gender'))
+    if error:
+      return jsonify({
+        'success': False,
+        "error": 422,
+        'message': error
+      }), 422
 
     try:
-      if name is not None:
-        actor.name = name
-      if age is not None:
-        actor.age = age
-      if gender is not None:
-        actor.gender = gender
+      for field, value in values.items():
+        setattr(actor, field, value)
 
       actor.update()
+      actor = Actor.load_query().filter(Actor.id == actor_id).one()
 
       return jsonify({
         'success': True,
@@ -215,16 +590,20 @@ def create_app(test_config=None):
       abort(404)
 
     body = request.get_json()
-    title = body.get('title', None)
-    release_date = body.get('release_date', None)
+    values, error = parse_fields(body, ('title', 'release_date'))
+    if error:
+      return jsonify({
+        'success': False,
+        "error": 422,
+        'message': error
+      }), 422
 
     try:
-      if title is not None:
-        movie.title = title
-      if release_date is not None:
-        movie.release_date = release_date
+      for field, value in values.items():
+        setattr(movie, field, value)
 
       movie.update()
+      movie = Movie.load_query().filter(Movie.id == movie_id).one()
 
       return jsonify({
         'success': True,
@@ -236,38 +615,307 @@ def create_app(test_config=None):
 
   @app.route('/movieroles', methods=['POST'])
   @requires_auth('post:movie_roles')
+  @idempotency_store.idempotent
   def new_movie_role(payload):
     body = request.get_json()
-    actor_id = body.get('actor_id', None)
-    movie_id = body.get('movie_id', None)
+    values, error = parse_fields(body, ('actor_id', 'movie_id'))
+    if not error:
+      actor_id = values.get('actor_id', None)
+      movie_id = values.get('movie_id', None)
+      if actor_id is None:
+        error = 'Invalid actor_id'
+      elif movie_id is None:
+        error = 'Invalid movie_id'
+
+    # The actor and movie are only looked up when the insert fails its
+    # foreign keys. An existing role is returned rather than duplicated.
+    if not error:
+      try:
+        movie_role_id, created = insert_role(actor_id, movie_id)
+        if created:
+          record_roles(db.session, [(actor_id, movie_id)])
+        db.session.commit()
+      except IntegrityError:
+        db.session.rollback()
+        if Actor.query.get(actor_id) is None:
+          error = 'No actor could be found for id ' + str(actor_id)
+        elif Movie.query.get(movie_id) is None:
+          error = 'No movie could be found for id ' + str(movie_id)
+        else:
+          abort(422)
+      except:
+        db.session.rollback()
+        abort(422)
+
+    if error:
+      return jsonify({
+        'success': False,
+        'error': 422,
+        'message': error
+      }), 422
 
-    actor = Actor.query.get(actor_id)
-    movie = Movie.query.get(movie_id)
+    return jsonify({
+      'success': True,
+      'id': movie_role_id,
+      'created': created
+    })
 
-    if not actor:
+  @app.route('/actors/bulk', methods=['POST'])
+  @requires_auth('post:actors')
+  @idempotency_store.idempotent
+  def new_actors(payload):
+    items, error = get_bulk_items(request)
+
+    if error:
       return jsonify({
         'success': False,
         'error': 422,
-        'message': 'No actor could be found for id ' + str(actor_id)
+        'message': error
       }), 422
-    if not movie:
+
+    return bulk_create(request, Actor, items, validate_actor, ('name', 'age', 'gender'))
+
+  @app.route('/movies/bulk', methods=['POST'])
+  @requires_auth('post:movies')
+  @idempotency_store.idempotent
+  def new_movies(payload):
+    items, error = get_bulk_items(request)
+
+    if error:
       return jsonify({
         'success': False,
         'error': 422,
-        'message': 'No movie could be found for id ' + str(movie_id)
+        'message': error
       }), 422
 
-    try:
-      movie_role = MovieRole(actor=actor, movie=movie)
-      movie_role.insert()
+    return bulk_create(request, Movie, items, validate_movie, ('title', 'release_date'))
 
+  @app.route('/movieroles/bulk', methods=['POST'])
+  @requires_auth('post:movie_roles')
+  @idempotency_store.idempotent
+  def new_movie_roles(payload):
+    items, error = get_bulk_items(request)
+
+    if error:
       return jsonify({
-        'success': True,
-        'id': movie_role.id
-      })
+        'success': False,
+        'error': 422,
+        'message': error
+      }), 422
 
-    except:
-      abort(422)
+    # Resolve every referenced actor and movie with one IN query each
+    bodies = [parse_fields(item, ('actor_id', 'movie_id'))[0] or {} for item in items if isinstance(item, dict)]
+    actor_ids = {body['actor_id'] for body in bodies if 'actor_id' in body}
+    movie_ids = {body['movie_id'] for body in bodies if 'movie_id' in body}
+    actor_ids = {id for (id,) in db.session.query(Actor.id).filter(Actor.id.in_(actor_ids))}
+    movie_ids = {id for (id,) in db.session.query(Movie.id).filter(Movie.id.in_(movie_ids))}
+    castings = set(db.session.query(MovieRole.actor_id, MovieRole.movie_id).filter(MovieRole.actor_id.in_(actor_ids)))
+
+    def validate_movie_role(body):
+      if body.get('actor_id', None) not in actor_ids:
+        return 'No actor could be found for id ' + str(body.get('actor_id', None))
+      if body.get('movie_id', None) not in movie_ids:
+        return 'No movie could be found for id ' + str(body.get('movie_id', None))
+      if (body['actor_id'], body['movie_id']) in castings:
+        return 'Actor ' + str(body['actor_id']) + ' already has a role in movie ' + str(body['movie_id'])
+      castings.add((body['actor_id'], body['movie_id']))
+
+    return bulk_create(request, MovieRole, items, validate_movie_role, ('actor_id', 'movie_id'))
+
+  @app.route('/actors/bulk', methods=['PATCH'])
+  @requires_auth('update:actors')
+  def update_actors(payload):
+    items, error = get_bulk_items(request)
+
+    if error:
+      return jsonify({
+        'success': False,
+        'error': 422,
+        'message': error
+      }), 422
+
+    return bulk_update(request, Actor, items, ('name', 'age', 'gender'))
+
+  @app.route('/movies/bulk', methods=['PATCH'])
+  @requires_auth('update:movies')
+  def update_movies(payload):
+    items, error = get_bulk_items(request)
+
+    if error:
+      return jsonify({
+        'success': False,
+        'error': 422,
+        'message': error
+      }), 422
+
+    return bulk_update(request, Movie, items, ('title', 'release_date'))
+
+  @app.route('/actors/bulk', methods=['DELETE'])
+  @requires_auth('delete:actors')
+  def delete_actors(payload):
+    items, error = get_bulk_items(request)
+
+    if error:
+      return jsonify({
+        'success': False,
+        'error': 422,
+        'message': error
+      }), 422
+
+    return bulk_destroy(request, Actor, items)
+
+  @app.route('/movies/bulk', methods=['DELETE'])
+  @requires_auth('delete:movies')
+  def delete_movies(payload):
+    items, error = get_bulk_items(request)
+
+    if error:
+      return jsonify({
+        'success': False,
+        'error': 422,
+        'message': error
+      }), 422
+
+    return bulk_destroy(request, Movie, items)
+
+  @app.route('/export', methods=['GET'])
+  @requires_auth('get:actors')
+  @read_only
+  @statement_timeout(EXPORT_STATEMENT_TIMEOUT)
+  def export_catalog(payload):
+    try:
+      types = parse_entity_types(request.args.get('type', None))
+      updated_since = parse_updated_since(request.args.get('updated_since', None))
+    except ValueError:
+      abort(400)
+
+    if 'movies' in types or 'movieroles' in types:
+      check_permissions('get:movies', payload)
+
+    return Response(stream_with_context(iter_export(types, updated_since)), mimetype='application/x-ndjson')
+
+  @app.route('/actors/<int:actor_id>/costars', methods=['GET'])
+  @requires_auth('get:actors')
+  @read_only
+  @conditional('Actor', 'MovieRole')
+  @response_cache.cached('Actor', 'MovieRole')
+  def get_co_stars(payload, actor_id):
+    limit = get_arg(request, 'limit', int)
+    if limit is None:
+      limit = ITEMS_PER_PAGE
+    if limit < 1:
+      abort(400)
+
+    casting_graph.sync()
+    counts = casting_graph.co_stars(actor_id)
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:min(limit, MAX_ITEMS_PER_PAGE)]
+
+    names = get_names(Actor, Actor.name, [actor_id] + [id for id, _ in ranked])
+    if actor_id not in names:
+      abort(404)
+
+    return jsonify({
+      'success': True,
+      'actor_id': actor_id,
+      'co_stars': [{'id': id, 'name': names[id], 'shared_movies': count} for id, count in ranked if id in names],
+      'total': len(counts)
+    }), 200
+
+  @app.route('/actors/<int:actor_id>/path/<int:other_id>', methods=['GET'])
+  @requires_auth('get:actors')
+  @read_only
+  @conditional('Actor', 'Movie', 'MovieRole')
+  @response_cache.cached('Actor', 'Movie', 'MovieRole')
+  def get_actor_path(payload, actor_id, other_id):
+    check_permissions('get:movies', payload)
+
+    casting_graph.sync()
+    path = casting_graph.path(actor_id, other_id) or []
+
+    actors = get_names(Actor, Actor.name, [actor_id, other_id] + path[2::2])
+    movies = get_names(Movie, Movie.title, path[1::2])
+    if actor_id not in actors or other_id not in actors:
+      abort(404)
+
+    # Actors and movies alternate along the path, starting with the actor
+    steps = None
+    if path:
+      steps = [{'type': 'actor', 'id': id, 'name': actors.get(id)} if index % 2 == 0 else
+               {'type': 'movie', 'id': id, 'title': movies.get(id)} for index, id in enumerate(path)]
+
+    return jsonify({
+      'success': True,
+      'hops': len(path) // 2 if path else None,
+      'path': steps
+    }), 200
+
+  @app.route('/actors/<int:actor_id>/sharedmovies/<int:other_id>', methods=['GET'])
+  @requires_auth('get:actors')
+  @read_only
+  @conditional('Actor', 'Movie', 'MovieRole')
+  @response_cache.cached('Actor', 'Movie', 'MovieRole')
+  def get_shared_movies(payload, actor_id, other_id):
+    check_permissions('get:movies', payload)
+    fields, _ = get_fieldset(request, Movie)
+
+    casting_graph.sync()
+    movie_ids = casting_graph.movies_of(actor_id) & casting_graph.movies_of(other_id)
+
+    if len(get_names(Actor, Actor.name, [actor_id, other_id])) < len({actor_id, other_id}):
+      abort(404)
+
+    movies = []
+    if movie_ids:
+      movies = Movie.load_query(fields, ()).filter(Movie.id.in_(movie_ids)).order_by(Movie.release_date, Movie.id).all()
+
+    with timed('format'):
+      movies = [movie.format(fields, ()) for movie in movies]
+
+    return jsonify({
+      'success': True,
+      'movies': movies
+    }), 200
+
+  @app.route('/stats', methods=['GET'])
+  @requires_auth('get:actors')
+  @read_only
+  def get_stats(payload):
+    check_permissions('get:movies', payload)
+    stats, computed_at, stale = stats_cache.get()
+
+    return jsonify({
+      'success': True,
+      'computed_at': computed_at,
+      'stale': stale,
+      **stats
+    }), 200
+
+  @app.route('/search', methods=['GET'])
+  @requires_auth('get:actors')
+  @read_only
+  def search(payload):
+    query = request.args.get('q', '').strip()
+    limit = get_arg(request, 'limit', int)
+    if limit is None:
+      limit = SEARCH_DEFAULT_LIMIT
+
+    try:
+      types = parse_search_types(request.args.get('type', None))
+    except ValueError:
+      abort(400)
+
+    if not query or limit < 1:
+      abort(400)
+    if 'movies' in types:
+      check_permissions('get:movies', payload)
+
+    kinds = [SEARCH_TYPES[search_type][0] for search_type in types]
+    results = search_index.find(query, kinds, min(limit, SEARCH_MAX_LIMIT))
+
+    return jsonify({
+      'success': True,
+      'results': results
+    }), 200
 
   @app.errorhandler(400)
   def bad_request(error):
@@ -309,6 +957,19 @@ def create_app(test_config=None):
       'message': error.error['description']
     }), error.status_code
 
+  # Statements cancelled by the statement timeout (SQLSTATE 57014)
+  @app.errorhandler(OperationalError)
+  def database_error(error):
+    if getattr(error.orig, 'pgcode', None) != '57014':
+      raise error
+
+    db.session.rollback()
+    return jsonify({
+      'success': False,
+      'error': 503,
+      'message': 'statement timeout'
+    }), 503
+
   return app
 
 APP = create_app()
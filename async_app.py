@@ -0,0 +1,27 @@
+# Entry point for serving the API with gevent workers, where each worker
+# handles many requests at once and switches between them whenever one waits
+# on the network: the JWKS fetch, database round trips or the client.
+#
+#   gunicorn -k gevent --worker-connections 500 async_app:APP
+#
+# The patching has to happen before anything else is imported, so that the
+# sockets, locks and psycopg2 connections used by the app yield instead of
+# blocking the whole worker.
+from gevent import monkey
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+import gevent
+
+from app import APP
+from auth.auth import jwks_store
+
+# Fetch the signing keys in the background as the worker starts. Requests
+# arriving before it completes wait for this fetch rather than start their own
+gevent.spawn(jwks_store.refresh_once)
+
+if __name__ == '__main__':
+    from gevent.pywsgi import WSGIServer
+    WSGIServer(('0.0.0.0', 8080), APP).serve_forever()
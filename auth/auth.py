@@ -1,21 +1,198 @@
 import os
 import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
 
+from metrics import collector, timed
+
 
 
 AUTH0_DOMAIN = os.getenv('AUTH0_DOMAIN')
 API_AUDIENCE = os.getenv('API_AUDIENCE')
 ALGORITHMS = ['RS256']
 
+# JWKS_URL may point at a local file (file:///path/to/jwks.json) for offline use
+JWKS_URL = os.getenv('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_TTL = int(os.getenv('JWKS_TTL', 600))
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = float(os.getenv('JWKS_FETCH_TIMEOUT', 5))
+
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', 10000))
+TOKEN_CACHE_MAX_TTL = int(os.getenv('TOKEN_CACHE_MAX_TTL', 3600))
+
 class AuthError(Exception):
     def __init__(self, error, status_code):
         self.error = error
         self.status_code = status_code
 
+# Per-process cache of the signing keys published at JWKS_URL. Keys are
+# served from memory for `ttl` seconds; after that the stale keys keep being
+# served while a background thread fetches a fresh copy. An unknown kid
+# triggers a synchronous refetch. Either way the keys are fetched at most once
+# every `min_refresh_interval`, even while the fetches keep failing.
+class JWKSKeyStore:
+    def __init__(self, url=JWKS_URL, ttl=JWKS_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    def fetch(self):
+        with timed('jwks'):
+            jsonurl = urlopen(self.url, timeout=self.timeout)
+            jwks = json.loads(jsonurl.read())
+        return {key['kid']: key for key in jwks['keys'] if 'kid' in key}
+
+    def refresh(self):
+        with self._lock:
+            self._last_attempt = time.monotonic()
+        try:
+            keys = self.fetch()
+        except Exception:
+            return False
+        finally:
+            self._refreshing = False
+
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or not self._can_refresh():
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def _can_refresh(self):
+        return (self._last_attempt is None or
+                time.monotonic() - self._last_attempt >= self.min_refresh_interval)
+
+    # Synchronous refresh shared by concurrent callers: those arriving while a
+    # fetch is in flight wait for its result instead of fetching again, or
+    # failing because of the rate limit
+    def refresh_once(self):
+        attempt = self._last_attempt
+        with self._fetch_lock:
+            if self._last_attempt == attempt and self._can_refresh():
+                self.refresh()
+
+    def get_key(self, kid):
+        if self._fetched_at is None:
+            self.refresh_once()
+            if self._fetched_at is None:
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch the signing keys.'
+                }, 503)
+
+        elif time.monotonic() - self._fetched_at >= self.ttl:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None:
+            self.refresh_once()
+            key = self._keys.get(kid)
+
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
+
+jwks_store = JWKSKeyStore()
+
+# Bounded LRU of already verified tokens, keyed by a hash of the raw token.
+# Each entry expires at the token's exp claim (capped at `max_ttl` seconds)
+# and keeps the permissions as a set so checks are a single lookup.
+class VerifiedTokenCache:
+    def __init__(self, max_entries=TOKEN_CACHE_MAX_ENTRIES, max_ttl=TOKEN_CACHE_MAX_TTL):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, token, payload):
+        permissions = None
+        if 'permissions' in payload:
+            permissions = frozenset(payload['permissions'])
+
+        expires_at = time.time() + self.max_ttl
+        if isinstance(payload.get('exp'), (int, float)):
+            expires_at = min(expires_at, payload['exp'])
+
+        if self.max_entries > 0:
+            key = self._key(token)
+            with self._lock:
+                self._entries[key] = (expires_at, payload, permissions)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return payload, permissions
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_entries': self.max_entries
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+token_cache = VerifiedTokenCache()
+
+@collector
+def _token_cache_metrics():
+    stats = token_cache.stats()
+    return [
+        ('token_cache_hits_total', 'counter', 'Requests whose token was found in the verified token cache.', stats['hits']),
+        ('token_cache_misses_total', 'counter', 'Requests whose token had to be verified.', stats['misses']),
+        ('token_cache_entries', 'gauge', 'Tokens held in the verified token cache.', stats['size'])
+    ]
+
 def get_token_auth_header():
     auth = request.headers.get('Authorization', None)
     if not auth:
@@ -46,14 +223,17 @@ def get_token_auth_header():
     token = parts[1]
     return token
 
-def check_permissions(permission, payload):
+def check_permissions(permission, payload, permissions=None):
     if 'permissions' not in payload:
         raise AuthError({
             'code': 'invalid_claims',
             'description': 'Permissions not included in JWT.'
         }, 400)
 
-    if permission not in payload['permissions']:
+    if permissions is None:
+        permissions = payload['permissions']
+
+    if permission not in permissions:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -62,8 +242,6 @@ def check_permissions(permission, payload):
     return True
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
     rsa_key = {}
     if 'kid' not in unverified_header:
@@ -72,15 +250,15 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    key = jwks_store.get_key(unverified_header['kid'])
+    if key:
+        rsa_key = {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        }
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -120,9 +298,15 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with timed('auth'):
+                token = get_token_auth_header()
+                cached = token_cache.get(token)
+                if cached is None:
+                    cached = token_cache.put(token, verify_decode_jwt(token))
+
+                payload, permissions = cached
+                check_permissions(permission, payload, permissions)
+                _request_ctx_stack.top.current_user = payload
             return f(payload, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,257 @@
+# End-to-end benchmark of every route in create_app. Seeds a database, signs
+# tokens with a local keypair (see local_auth.py) and replays requests through
+# the Flask test client, so it runs fully offline. Throughput and latency
+# percentiles per route are written to a JSON file that can be passed back
+# with --baseline to compare two runs.
+#
+#   python benchmarks/bench_api.py --output before.json
+#   python benchmarks/bench_api.py --database-url postgresql://localhost:5432/casting_agency_bench --baseline before.json
+#
+# The database is dropped and recreated, never point it at real data.
+import os
+import sys
+import json
+import math
+import random
+import argparse
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from local_auth import LocalAuth
+
+# Heavy routes run this fraction of the requests of the others
+EXPORT_SHARE = 0.1
+
+def seed(db, actors, movies, roles_per_actor):
+    start = datetime(1990, 1, 1)
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(db.metadata.tables['Actor'].insert(), [
+        {'name': 'Actor ' + str(i), 'age': random.randint(18, 80),
+         'gender': random.choice(['Female', 'Male'])} for i in range(1, actors + 1)])
+    db.session.execute(db.metadata.tables['Movie'].insert(), [
+        {'title': 'Movie ' + str(i), 'release_date': start + timedelta(days=random.randint(0, 12000))}
+        for i in range(1, movies + 1)])
+    db.session.execute(db.metadata.tables['MovieRole'].insert(), [
+        {'actor_id': actor_id, 'movie_id': movie_id}
+        for actor_id in range(1, actors + 1)
+        for movie_id in random.sample(range(1, movies + 1), min(roles_per_actor, movies))])
+    db.session.commit()
+
+# One entry per route and method: the role whose token is used, and a function
+# of the request number returning the path and JSON body. Rows that a request
+# consumes, like the target of a DELETE, are created by `prepare` outside of
+# the timed section.
+def scenarios(args):
+    from models import db, Actor, Movie, bulk_insert
+
+    def new_actor(n):
+        actor = Actor(name='Benchmark actor ' + str(n), age=30, gender='Female')
+        actor.insert()
+        return actor.id
+
+    def new_movie(n):
+        movie = Movie(title='Benchmark movie ' + str(n), release_date=datetime(2020, 1, 1))
+        movie.insert()
+        return movie.id
+
+    def new_actors(n):
+        ids = bulk_insert(Actor, [{'name': 'Benchmark actor ' + str(n), 'age': 30, 'gender': 'Female'}] * args.bulk_size)
+        db.session.commit()
+        return ids
+
+    def new_movies(n):
+        ids = bulk_insert(Movie, [{'title': 'Benchmark movie ' + str(n), 'release_date': datetime(2020, 1, 1)}] * args.bulk_size)
+        db.session.commit()
+        return ids
+
+    actor_pages = max(1, args.actors // 10)
+    movie_pages = max(1, args.movies // 10)
+    return {
+        ('/actors', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/actors?page=' + str(n % actor_pages + 1), None)),
+        ('/movies', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/movies?page=' + str(n % movie_pages + 1), None)),
+        ('/actors/<int:actor_id>', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/actors/' + str(random.randint(1, args.actors)), None)),
+        ('/movies/<int:movie_id>', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/movies/' + str(random.randint(1, args.movies)), None)),
+        ('/actors', 'POST'): ('casting_director', None,
+            lambda n, _: ('/actors', {'name': 'Actor ' + str(n), 'age': 40, 'gender': 'Male'})),
+        ('/movies', 'POST'): ('executive_producer', None,
+            lambda n, _: ('/movies', {'title': 'Movie ' + str(n), 'release_date': '2021-10-01'})),
+        ('/actors/<int:actor_id>', 'PATCH'): ('casting_director', None,
+            lambda n, _: ('/actors/' + str(random.randint(1, args.actors)), {'age': random.randint(18, 80)})),
+        ('/movies/<int:movie_id>', 'PATCH'): ('casting_director', None,
+            lambda n, _: ('/movies/' + str(random.randint(1, args.movies)), {'title': 'Movie ' + str(n)})),
+        ('/actors/<int:actor_id>', 'DELETE'): ('casting_director', new_actor,
+            lambda n, actor_id: ('/actors/' + str(actor_id), None)),
+        ('/movies/<int:movie_id>', 'DELETE'): ('executive_producer', new_movie,
+            lambda n, movie_id: ('/movies/' + str(movie_id), None)),
+        ('/movieroles', 'POST'): ('casting_director', new_actor,
+            lambda n, actor_id: ('/movieroles', {'actor_id': actor_id, 'movie_id': random.randint(1, args.movies)})),
+        ('/actors/bulk', 'POST'): ('casting_director', None,
+            lambda n, _: ('/actors/bulk', [{'name': 'Actor ' + str(n), 'age': 40, 'gender': 'Male'}] * args.bulk_size)),
+        ('/movies/bulk', 'POST'): ('executive_producer', None,
+            lambda n, _: ('/movies/bulk', [{'title': 'Movie ' + str(n), 'release_date': '2021-10-01'}] * args.bulk_size)),
+        ('/movieroles/bulk', 'POST'): ('casting_director', new_actor,
+            lambda n, actor_id: ('/movieroles/bulk', [{'actor_id': actor_id, 'movie_id': movie_id}
+                for movie_id in random.sample(range(1, args.movies + 1), min(args.bulk_size, args.movies))])),
+        ('/actors/bulk', 'PATCH'): ('casting_director', None,
+            lambda n, _: ('/actors/bulk', [{'id': actor_id, 'age': random.randint(18, 80)}
+                for actor_id in random.sample(range(1, args.actors + 1), min(args.bulk_size, args.actors))])),
+        ('/movies/bulk', 'PATCH'): ('casting_director', None,
+            lambda n, _: ('/movies/bulk', [{'id': movie_id, 'title': 'Movie ' + str(n)}
+                for movie_id in random.sample(range(1, args.movies + 1), min(args.bulk_size, args.movies))])),
+        ('/actors/bulk', 'DELETE'): ('casting_director', new_actors,
+            lambda n, actor_ids: ('/actors/bulk', actor_ids)),
+        ('/movies/bulk', 'DELETE'): ('executive_producer', new_movies,
+            lambda n, movie_ids: ('/movies/bulk', movie_ids)),
+        ('/export', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/export', None)),
+        ('/actors/<int:actor_id>/costars', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/actors/' + str(random.randint(1, args.actors)) + '/costars', None)),
+        ('/actors/<int:actor_id>/path/<int:other_id>', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/actors/{}/path/{}'.format(random.randint(1, args.actors), random.randint(1, args.actors)), None)),
+        ('/actors/<int:actor_id>/sharedmovies/<int:other_id>', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/actors/{}/sharedmovies/{}'.format(random.randint(1, args.actors), random.randint(1, args.actors)), None)),
+        ('/stats', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/stats', None)),
+        ('/search', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/search?q=actor ' + str(random.randint(1, args.actors))[:2], None)),
+        ('/metrics', 'GET'): ('casting_assistant', None,
+            lambda n, _: ('/metrics', None)),
+    }
+
+def percentile(timings, p):
+    return timings[max(0, math.ceil(p / 100 * len(timings)) - 1)]
+
+def run_route(app, headers, method, prepare, build, requests, warmup):
+    client = app.test_client()
+    timings = []
+    statuses = {}
+    for n in range(warmup + requests):
+        prepared = None
+        if prepare:
+            with app.app_context():
+                prepared = prepare(n)
+        path, body = build(n, prepared)
+        started = time.perf_counter()
+        response = client.open(path, method=method, headers=headers, json=body)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+
+        if n >= warmup:
+            timings.append(elapsed)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    total = sum(timings)
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'errors': sum(count for status, count in statuses.items() if not status.startswith('2')),
+        'statuses': statuses,
+        'throughput': len(timings) / total,
+        'mean_ms': total / len(timings) * 1000,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'max_ms': timings[-1] * 1000
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    print('{:<36} {:>9} {:>10} {:>9} {:>9} {:>9} {:>7}'.format('route', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for name, route in results['routes'].items():
+        line = '{:<36} {:>9} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7}'.format(
+            name, route['requests'], route['throughput'], route['p50_ms'], route['p95_ms'], route['p99_ms'], route['errors'])
+        if baseline and name in baseline['routes']:
+            line += '  p50 {:+.1%}'.format(route['p50_ms'] / baseline['routes'][name]['p50_ms'] - 1)
+        print(line)
+
+    for name in results['uncovered']:
+        print('{:<36} not benchmarked, add it to scenarios()'.format(name))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default=None, help='Database to seed (default: a temporary SQLite file)')
+    parser.add_argument('--actors', type=int, default=1000)
+    parser.add_argument('--movies', type=int, default=200)
+    parser.add_argument('--roles-per-actor', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per route')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--bulk-size', type=int, default=100)
+    parser.add_argument('--route', action='append', help='Only run the given route, e.g. "GET /actors" (repeatable)')
+    parser.add_argument('--output', default='bench_api.json')
+    parser.add_argument('--baseline', default=None, help='Results file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    # The models and app read their configuration when first imported
+    os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    from app import create_app
+    from models import db
+
+    random.seed(0)
+    local_auth = LocalAuth()
+    local_auth.install()
+    app = create_app()
+    headers = {role: local_auth.headers(role) for role in ('casting_assistant', 'casting_director', 'executive_producer')}
+
+    with app.app_context():
+        seed(db, args.actors, args.movies, args.roles_per_actor)
+        database = db.engine.dialect.name
+
+    results = {
+        'commit': git_commit(),
+        'started_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'database': database,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'database_url')},
+        'routes': {},
+        'uncovered': []
+    }
+
+    routes = scenarios(args)
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if rule.endpoint == 'static':
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            name = method + ' ' + rule.rule
+            if args.route and name not in args.route:
+                continue
+            if (rule.rule, method) not in routes:
+                results['uncovered'].append(name)
+                continue
+
+            role, prepare, build = routes[(rule.rule, method)]
+            requests = args.requests
+            if rule.rule == '/export':
+                requests = max(1, int(requests * EXPORT_SHARE))
+            results['routes'][name] = run_route(app, headers[role], method, prepare, build, requests, min(args.warmup, requests))
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print('{} actors, {} movies, {} roles per actor on {}'.format(args.actors, args.movies, args.roles_per_actor, results['database']))
+    print_results(results, baseline)
+    print('Results written to ' + args.output)
+
+if __name__ == '__main__':
+    main()
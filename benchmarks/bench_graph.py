@@ -0,0 +1,65 @@
+# Builds the co-star graph from generated movie roles and times co-star,
+# shortest path and shared movie queries on it, along with incremental role
+# changes. No database is needed.
+#
+#   python benchmarks/bench_graph.py
+#   python benchmarks/bench_graph.py --actors 1000000 --movies 100000 --roles-per-actor 5
+import os
+import sys
+import random
+import argparse
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from graph import Adjacency, CastingGraph
+
+def build(actors, movies, roles_per_actor, seed=0):
+    rng = random.Random(seed)
+    roles = sorted((actor_id, movie_id) for actor_id in range(1, actors + 1)
+                   for movie_id in rng.sample(range(1, movies + 1), roles_per_actor))
+
+    graph = CastingGraph()
+    graph.version = 0
+    graph.actors = Adjacency(roles)
+    roles.sort(key=lambda role: (role[1], role[0]))
+    graph.movies = Adjacency((movie_id, actor_id) for actor_id, movie_id in roles)
+    return graph
+
+def measure(name, f, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        f()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print('{:<20} {:>10.3f} {:>10.3f}'.format(name, timings[len(timings) // 2] * 1000, timings[-1] * 1000))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--actors', type=int, default=500000)
+    parser.add_argument('--movies', type=int, default=50000)
+    parser.add_argument('--roles-per-actor', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    graph = build(args.actors, args.movies, args.roles_per_actor)
+    print('Loaded {} roles in {:.1f} s'.format(len(graph), time.perf_counter() - started))
+
+    rng = random.Random(1)
+    pick = lambda: rng.randint(1, args.actors)
+    print('{:<20} {:>10} {:>10}'.format('query', 'p50 ms', 'max ms'))
+    measure('co-stars', lambda: graph.co_stars(pick()), args.repeat)
+    measure('shared movies', lambda: graph.movies_of(pick()) & graph.movies_of(pick()), args.repeat)
+    measure('shortest path', lambda: graph.path(pick(), pick()), args.repeat)
+
+    def change():
+        actor_id, movie_id = pick(), rng.randint(1, args.movies)
+        graph.add_role(actor_id, movie_id)
+        graph.remove_role(actor_id, movie_id)
+    measure('add + remove role', change, args.repeat * 20)
+    measure('queries on overlay', lambda: graph.path(pick(), pick()), args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# Measures the queries behind relationship loading, cascade deletes, sorting
+# and filtering on a seeded dataset, first without and then with the indexes
+# and unique constraint added in migration 7e4b2d9c1a38.
+#
+#   python benchmarks/bench_indexes.py --roles 100000
+#   python benchmarks/bench_indexes.py --database-url postgresql://localhost:5432/casting_agency_bench
+import os
+import sys
+import random
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import MetaData, UniqueConstraint, create_engine, text
+
+from models import db
+
+QUERIES = [
+    ('roles of a page of actors', 'SELECT * FROM "MovieRole" WHERE actor_id IN ({actor_ids})'),
+    ('cast of a movie', 'SELECT * FROM "MovieRole" WHERE movie_id = {movie_id}'),
+    ('cascade delete lookup', 'SELECT id FROM "MovieRole" WHERE movie_id = {movie_id}'),
+    ('duplicate casting check', 'SELECT id FROM "MovieRole" WHERE actor_id = {actor_id} AND movie_id = {movie_id}'),
+    ('movies sorted by release date', 'SELECT * FROM "Movie" ORDER BY release_date, id LIMIT 10'),
+    ('actor by name', 'SELECT * FROM "Actor" WHERE name = \'Actor {actor_id}\''),
+]
+
+INDEXES = [
+    'CREATE UNIQUE INDEX "uq_MovieRole_actor_id_movie_id" ON "MovieRole" (actor_id, movie_id)',
+    'CREATE INDEX "ix_MovieRole_movie_id" ON "MovieRole" (movie_id)',
+    'CREATE INDEX "ix_Actor_name" ON "Actor" (name)',
+    'CREATE INDEX "ix_Movie_release_date" ON "Movie" (release_date)',
+]
+
+def create_schema(engine):
+    # Same tables as the models but without the new indexes and constraint
+    metadata = MetaData()
+    for table in db.metadata.sorted_tables:
+        copy = table.tometadata(metadata)
+        copy.indexes.clear()
+        copy.constraints = {constraint for constraint in copy.constraints if not isinstance(constraint, UniqueConstraint)}
+        for column in copy.columns:
+            column.index = None
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+def seed(engine, actors, movies, roles):
+    start = datetime(1990, 1, 1)
+    pairs = set()
+    while len(pairs) < roles:
+        pairs.add((random.randint(1, actors), random.randint(1, movies)))
+
+    with engine.begin() as connection:
+        connection.execute(db.metadata.tables['Actor'].insert(), [
+            {'id': i, 'name': 'Actor ' + str(i), 'age': random.randint(18, 80),
+             'gender': random.choice(['Female', 'Male'])} for i in range(1, actors + 1)])
+        connection.execute(db.metadata.tables['Movie'].insert(), [
+            {'id': i, 'title': 'Movie ' + str(i),
+             'release_date': start + timedelta(days=random.randint(0, 12000))} for i in range(1, movies + 1)])
+        connection.execute(db.metadata.tables['MovieRole'].insert(), [
+            {'actor_id': actor_id, 'movie_id': movie_id} for actor_id, movie_id in pairs])
+
+def run_queries(engine, actors, movies, repeat):
+    timings = {}
+    with engine.connect() as connection:
+        for name, sql in QUERIES:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                actor_id = random.randint(1, actors)
+                connection.execute(text(sql.format(
+                    actor_ids=', '.join(str(random.randint(1, actors)) for _ in range(10)),
+                    actor_id=actor_id, movie_id=random.randint(1, movies)))).fetchall()
+            timings[name] = (time.perf_counter() - started) / repeat * 1000
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default=None, help='Database to seed (default: a temporary SQLite file)')
+    parser.add_argument('--actors', type=int, default=20000)
+    parser.add_argument('--movies', type=int, default=5000)
+    parser.add_argument('--roles', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine(database_url)
+
+    create_schema(engine)
+    seed(engine, args.actors, args.movies, args.roles)
+    before = run_queries(engine, args.actors, args.movies, args.repeat)
+
+    with engine.begin() as connection:
+        for statement in INDEXES:
+            connection.execute(text(statement))
+        if engine.dialect.name == 'postgresql':
+            connection.execute(text('ANALYZE'))
+    after = run_queries(engine, args.actors, args.movies, args.repeat)
+
+    print('{} actors, {} movies, {} roles on {}'.format(args.actors, args.movies, args.roles, engine.dialect.name))
+    print('{:<32} {:>12} {:>12} {:>10}'.format('query', 'before (ms)', 'after (ms)', 'speedup'))
+    for name, _ in QUERIES:
+        print('{:<32} {:>12.3f} {:>12.3f} {:>9.1f}x'.format(name, before[name], after[name], before[name] / after[name]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Compares the JSON backends on a page of actors with nested movies, the
+# largest payload the API produces. The page is built from unsaved model
+# instances, so no database is needed.
+#
+#   python benchmarks/bench_json.py
+#   python benchmarks/bench_json.py --actors 1000 --movies-per-actor 10 --repeat 50
+import os
+import sys
+import argparse
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask, jsonify as flask_jsonify
+
+from models import Actor, Movie, MovieRole
+from serialization import BACKENDS, jsonify
+
+def build_page(actors, movies_per_actor):
+    start = datetime(1990, 1, 1)
+    movies = [Movie(title='Movie ' + str(i), release_date=start + timedelta(days=i)) for i in range(movies_per_actor * 10)]
+    for i, movie in enumerate(movies):
+        movie.id = i + 1
+
+    page = []
+    for i in range(actors):
+        actor = Actor(name='Actor ' + str(i), age=20 + i % 60, gender='Female' if i % 2 else 'Male')
+        actor.id = i + 1
+        for j in range(movies_per_actor):
+            MovieRole(actor=actor, movie=movies[(i + j) % len(movies)])
+        page.append(actor)
+    return page
+
+def format_with_strftime(actor):
+    # Actor.format() as it was before format_date
+    return {
+        'id': actor.id,
+        'name': actor.name,
+        'age': actor.age,
+        'gender': actor.gender,
+        'movies': [{
+            'id': role.movie.id,
+            'title': role.movie.title,
+            'release_date': role.movie.release_date.strftime("%d-%m-%Y")
+        } for role in actor.movie_roles]
+    }
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--actors', type=int, default=1000)
+    parser.add_argument('--movies-per-actor', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    page = build_page(args.actors, args.movies_per_actor)
+    app = Flask(__name__)
+
+    print(f'{args.actors} actors with {args.movies_per_actor} movies each, median of {args.repeat} runs')
+    print(f'{"format (strftime)":<28}{measure(lambda: [format_with_strftime(actor) for actor in page], args.repeat):>10.2f} ms')
+    print(f'{"format (format_date)":<28}{measure(lambda: [actor.format() for actor in page], args.repeat):>10.2f} ms')
+
+    body = {'success': True, 'actors': [actor.format() for actor in page]}
+    with app.app_context():
+        print(f'{"flask.jsonify":<28}{measure(lambda: flask_jsonify(body), args.repeat):>10.2f} ms')
+
+        for name, backend_class in BACKENDS.items():
+            try:
+                app.extensions['json_backend'] = backend_class()
+            except ImportError:
+                print(f'{name:<28}{"not installed":>13}')
+                continue
+            print(f'{name:<28}{measure(lambda: jsonify(body), args.repeat):>10.2f} ms')
+
+if __name__ == '__main__':
+    main()
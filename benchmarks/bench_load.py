@@ -0,0 +1,162 @@
+# Load comparison of the sync app (gunicorn app:APP) and the gevent app
+# (gunicorn -k gevent async_app:APP). Both are started on a seeded database
+# with the same number of workers and driven at increasing concurrency, with
+# the response cache disabled so every request reaches the database. Tokens
+# come from a local keypair (see local_auth.py), so it runs fully offline.
+#
+#   python benchmarks/bench_load.py --database-url postgresql://localhost:5432/casting_agency_bench
+#   python benchmarks/bench_load.py --concurrency 10,100,400 --duration 20 --path "/actors?per_page=50"
+#
+# The database is dropped and recreated, never point it at real data. Use
+# PostgreSQL: SQLite calls block the whole gevent worker.
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import time
+import http.client
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from local_auth import LocalAuth
+from bench_api import git_commit, percentile, seed
+
+def server_command(mode, port, workers, worker_connections):
+    command = [sys.executable, '-m', 'gunicorn', '--bind', '127.0.0.1:' + str(port), '--workers', str(workers)]
+    if mode == 'gevent':
+        return command + ['--worker-class', 'gevent', '--worker-connections', str(worker_connections), 'async_app:APP']
+    return command + ['app:APP']
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Server did not start on port ' + str(port))
+
+# Every client sends requests back to back on a new connection each time,
+# since sync workers close the connection after every response
+def run_load(port, path, headers, concurrency, duration):
+    timings = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                (timings if ok else errors).append(elapsed)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    timings.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(timings),
+        'errors': len(errors),
+        'throughput': len(timings) / elapsed,
+        'p50_ms': percentile(timings, 50) * 1000 if timings else None,
+        'p95_ms': percentile(timings, 95) * 1000 if timings else None,
+        'p99_ms': percentile(timings, 99) * 1000 if timings else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default=None, help='Database to seed (default: a temporary SQLite file)')
+    parser.add_argument('--actors', type=int, default=1000)
+    parser.add_argument('--movies', type=int, default=200)
+    parser.add_argument('--roles-per-actor', type=int, default=5)
+    parser.add_argument('--path', default='/actors', help='Route to request')
+    parser.add_argument('--concurrency', default='10,50,200', help='Comma separated numbers of concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers for both apps')
+    parser.add_argument('--worker-connections', type=int, default=500)
+    parser.add_argument('--modes', default='sync,gevent')
+    parser.add_argument('--output', default='bench_load.json')
+    args = parser.parse_args()
+
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    local_auth = LocalAuth()
+    environ = dict(os.environ, DATABASE_URL=database_url, RESPONSE_CACHE_TTL='0', REQUEST_LOG_ENABLED='false',
+                   **local_auth.environ())
+
+    # The models and app read their configuration when first imported
+    os.environ['DATABASE_URL'] = database_url
+    from app import APP
+    from models import db
+
+    with APP.app_context():
+        seed(db, args.actors, args.movies, args.roles_per_actor)
+        database = db.engine.dialect.name
+        db.session.remove()
+        db.engine.dispose()
+
+    headers = local_auth.headers('casting_assistant')
+    results = {
+        'commit': git_commit(),
+        'started_at': datetime.utcnow().isoformat(),
+        'database': database,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'database_url')},
+        'modes': {}
+    }
+
+    for mode in args.modes.split(','):
+        port = free_port()
+        server = subprocess.Popen(server_command(mode, port, args.workers, args.worker_connections),
+                                  cwd=ROOT, env=environ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            run_load(port, args.path, headers, args.workers, 1)
+            results['modes'][mode] = [run_load(port, args.path, headers, int(concurrency), args.duration)
+                                      for concurrency in args.concurrency.split(',')]
+        finally:
+            server.terminate()
+            server.wait()
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+
+    print('GET {} with {} workers on {}'.format(args.path, args.workers, database))
+    print('{:<8} {:>12} {:>9} {:>10} {:>9} {:>9} {:>9} {:>7}'.format(
+        'mode', 'concurrency', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for mode, levels in results['modes'].items():
+        for level in levels:
+            print('{:<8} {:>12} {:>9} {:>10.1f} {:>9} {:>9} {:>9} {:>7}'.format(
+                mode, level['concurrency'], level['requests'], level['throughput'],
+                *['{:.1f}'.format(level[key]) if level[key] is not None else '-' for key in ('p50_ms', 'p95_ms', 'p99_ms')],
+                level['errors']))
+    print('Results written to ' + args.output)
+
+if __name__ == '__main__':
+    main()
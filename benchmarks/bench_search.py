@@ -0,0 +1,73 @@
+# Builds the search index from generated actor names and movie titles and
+# times prefix queries against it. No database is needed.
+#
+#   python benchmarks/bench_search.py
+#   python benchmarks/bench_search.py --documents 100000 --queries "ka,kalin,kalin mo"
+import os
+import sys
+import random
+import argparse
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from search import SearchIndex
+
+SYLLABLES = ['an', 'ar', 'bel', 'cal', 'da', 'el', 'fin', 'gor', 'ha', 'is', 'jo', 'ka', 'lin', 'mo', 'na',
+             'or', 'pe', 'ra', 'ry', 'sa', 'ta', 'ul', 'va', 'wen', 'yo', 'zi']
+
+def vocabulary(rng, size):
+    return sorted({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize() for _ in range(size)})
+
+# Actors get a first and last name, movies a title of one to four words,
+# with names and words drawn from a few thousand made-up ones
+def build(documents, seed=0):
+    rng = random.Random(seed)
+    first_names, last_names, words = vocabulary(rng, 2000), vocabulary(rng, 8000), vocabulary(rng, 5000)
+
+    index = SearchIndex()
+    with index._lock:
+        new_words = []
+        for i in range(documents):
+            if i % 2:
+                text = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+            else:
+                text = rng.choice(first_names) + ' ' + rng.choice(last_names)
+            index._index(i, text, new_words)
+        index._insert_terms(new_words)
+    return index
+
+# Type-ahead steps for the name of the first actor
+def default_queries(index):
+    first, last = index.documents[0].split()
+    return [first[:1], first[:3], first, first + ' ' + last[:2], first + ' ' + last, 'zzz']
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=1000000)
+    parser.add_argument('--queries', default=None, help='Comma separated queries (default: typing an actor name)')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = build(args.documents)
+    print('Indexed {} documents, {} distinct words, in {:.1f} s'.format(
+        len(index), len(index.terms), time.perf_counter() - started))
+
+    print('{:<16} {:>8} {:>10} {:>10}'.format('query', 'results', 'mean ms', 'max ms'))
+    for query in args.queries.split(',') if args.queries else default_queries(index):
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            results = index.search(query, limit=10)
+            timings.append(time.perf_counter() - started)
+        print('{:<16} {:>8} {:>10.3f} {:>10.3f}'.format(
+            query, len(results), sum(timings) / len(timings) * 1000, max(timings) * 1000))
+
+    started = time.perf_counter()
+    for i in range(1000):
+        index.add(i * 2, 'Renamed Actor ' + str(i))
+    print('1000 incremental updates in {:.1f} ms'.format((time.perf_counter() - started) * 1000))
+
+if __name__ == '__main__':
+    main()
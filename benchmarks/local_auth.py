@@ -0,0 +1,68 @@
+# Offline stand-in for Auth0: a freshly generated RSA keypair whose public
+# key is served from a local JWKS file, and tokens signed with it that
+# verify_decode_jwt accepts. Used by the benchmarks so they need no network
+# access or real Auth0 tokens.
+import os
+import json
+import time
+import tempfile
+
+import rsa
+from jose import jwk, jwt
+
+from auth import auth
+
+DOMAIN = 'casting-agency.local'
+AUDIENCE = 'casting-agency-benchmarks'
+KID = 'local-benchmark-key'
+
+# Permissions of the roles described in the README
+ROLES = {
+    'casting_assistant': ['get:actors', 'get:movies'],
+    'casting_director': ['get:actors', 'get:movies', 'post:actors', 'post:movie_roles',
+                         'update:actors', 'update:movies', 'delete:actors'],
+    'executive_producer': ['get:actors', 'get:movies', 'post:actors', 'post:movies', 'post:movie_roles',
+                           'update:actors', 'update:movies', 'delete:actors', 'delete:movies']
+}
+
+class LocalAuth:
+    def __init__(self, key_size=2048):
+        public_key, private_key = rsa.newkeys(key_size)
+        self.private_key = private_key.save_pkcs1().decode()
+
+        key = jwk.construct(public_key.save_pkcs1().decode(), 'RS256').to_dict()
+        key.update(kid=KID, use='sig')
+        self.jwks_path = os.path.join(tempfile.mkdtemp(), 'jwks.json')
+        with open(self.jwks_path, 'w') as jwks:
+            json.dump({'keys': [key]}, jwks)
+
+    # Points the auth module at the local issuer and JWKS file. Must be
+    # called before the first request is served.
+    def install(self):
+        auth.AUTH0_DOMAIN = DOMAIN
+        auth.API_AUDIENCE = AUDIENCE
+        auth.jwks_store = auth.JWKSKeyStore(url='file://' + self.jwks_path)
+        auth.token_cache.clear()
+
+    # The same settings as environment variables, for servers started in a
+    # separate process
+    def environ(self):
+        return {
+            'AUTH0_DOMAIN': DOMAIN,
+            'API_AUDIENCE': AUDIENCE,
+            'JWKS_URL': 'file://' + self.jwks_path
+        }
+
+    def token(self, permissions, subject='benchmark', ttl=3600):
+        claims = {
+            'iss': 'https://' + DOMAIN + '/',
+            'aud': AUDIENCE,
+            'sub': 'local|' + subject,
+            'iat': int(time.time()),
+            'exp': int(time.time()) + ttl,
+            'permissions': list(permissions)
+        }
+        return jwt.encode(claims, self.private_key, algorithm='RS256', headers={'kid': KID})
+
+    def headers(self, role):
+        return {'Authorization': 'Bearer ' + self.token(ROLES[role], subject=role)}
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import timezone
+from functools import wraps
+from collections import OrderedDict
+from flask import current_app, g, make_response, request
+
+from metrics import collector
+from models import REPLICA_LAG_TOLERANCE, reading_from_replica, TableVersion
+
+RESPONSE_CACHE_URL = os.getenv('RESPONSE_CACHE_URL', 'memory://')
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+
+# In-process LRU, private to each worker
+class MemoryCacheBackend:
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Sets the key only when it holds no live entry, returning whether it did
+    def add(self, key, value, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return False
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Shared backend so every gunicorn worker sees the same entries and
+# invalidations. Takes any client with the redis-py get/set/delete API.
+class RedisCacheBackend:
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, value, ex=ttl, nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+def backend_from_url(url, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+    if url.startswith('memory://'):
+        return MemoryCacheBackend(max_entries)
+    return RedisCacheBackend.from_url(url)
+
+# TableVersion rows of the given tables, read once per request so the ETag
+# and the response cache key of a request always agree
+def table_versions(tables):
+    versions = g.setdefault('table_versions', {})
+    key = tuple(tables)
+    if key not in versions:
+        versions[key] = TableVersion.get_many(tables)
+    return versions[key]
+
+# Caches successful GET responses keyed by route, query string, the caller's
+# permissions and the TableVersion version of every table the response
+# reads. A commit from any worker that writes a table bumps its version, so
+# entries built from the old data are never looked up again and simply age
+# out.
+class ResponseCache:
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL, versions=table_versions):
+        self.backend = backend
+        self.ttl = ttl
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, tables, payload):
+        parts = [
+            request.path,
+            sorted(request.args.items(multi=True)),
+            sorted(payload.get('permissions', [])),
+            [(name, version) for name, version, _ in self.versions(tables)],
+            reading_from_replica()
+        ]
+        return 'response:' + hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def cached(self, *tables):
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(payload, *args, **kwargs):
+                if self.ttl <= 0:
+                    return f(payload, *args, **kwargs)
+
+                key = self._key(tables, payload)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    entry = json.loads(entry)
+                    return current_app.response_class(entry['body'], status=entry['status'], mimetype=entry['mimetype'])
+
+                self.misses += 1
+                response = make_response(f(payload, *args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    # A replica may still be catching up with the write that
+                    # bumped the version, so its responses are kept shorter
+                    ttl = self.ttl
+                    if reading_from_replica():
+                        ttl = max(1, min(ttl, int(REPLICA_LAG_TOLERANCE)))
+                    self.backend.set(key, json.dumps({
+                        'status': response.status_code,
+                        'mimetype': response.mimetype,
+                        'body': response.get_data(as_text=True)
+                    }), ttl)
+                return response
+
+            return wrapper
+        return cached_decorator
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+response_cache = ResponseCache(backend_from_url(RESPONSE_CACHE_URL))
+
+@collector
+def _response_cache_metrics():
+    stats = response_cache.stats()
+    return [
+        ('response_cache_hits_total', 'counter', 'GET responses served from the response cache.', stats['hits']),
+        ('response_cache_misses_total', 'counter', 'GET responses built because the response cache had no entry.', stats['misses'])
+    ]
+
+# Answers GET requests with 304 Not Modified when the client's ETag or
+# If-Modified-Since still matches. Both are derived from the TableVersion rows
+# of the tables the response reads. The view still runs first, so a missing
+# resource or permission is reported as usual, but placed above
+# response_cache.cached it is answered from the cache, whose key uses the
+# same versions.
+def conditional(*tables):
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            versions = table_versions(tables)
+            etag = hashlib.sha256(json.dumps([
+                request.path,
+                sorted(request.args.items(multi=True)),
+                sorted(payload.get('permissions', [])),
+                [(name, version) for name, version, _ in versions]
+            ]).encode()).hexdigest()
+
+            last_modified = None
+            timestamps = [updated_at for _, _, updated_at in versions if updated_at is not None]
+            if timestamps:
+                last_modified = max(timestamps).replace(microsecond=0, tzinfo=timezone.utc)
+
+            not_modified = etag in request.if_none_match
+            if not request.if_none_match and request.if_modified_since and last_modified:
+                not_modified = last_modified <= request.if_modified_since
+
+            response = make_response(f(payload, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if not_modified:
+                response = current_app.response_class(status=304)
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            return response
+
+        return wrapper
+    return conditional_decorator
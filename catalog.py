@@ -0,0 +1,229 @@
+import os
+import io
+import csv
+import sys
+import json
+import time
+from datetime import date, datetime
+
+from models import db, Actor, Movie, MovieRole, mark_changed
+
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+# Statement timeout in milliseconds for GET /export, 0 for none
+EXPORT_STATEMENT_TIMEOUT = int(os.getenv('EXPORT_STATEMENT_TIMEOUT', 0))
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 5000))
+
+# Entity types accepted by the export, keyed by the name used in ?type=
+ENTITY_TYPES = {
+    'actors': ('actor', Actor),
+    'movies': ('movie', Movie),
+    'movieroles': ('movie_role', MovieRole)
+}
+
+def parse_entity_types(value):
+    if not value:
+        return list(ENTITY_TYPES)
+
+    types = [entity_type.strip() for entity_type in value.split(',') if entity_type.strip()]
+    for entity_type in types:
+        if entity_type not in ENTITY_TYPES:
+            raise ValueError('Unknown entity type ' + entity_type)
+    return types
+
+def parse_updated_since(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(repr(value) + ' is not JSON serializable')
+
+# Yields one NDJSON line per row of each requested entity type. Only plain
+# columns are selected and rows are fetched `chunk_size` at a time through a
+# server-side cursor where the driver supports it, so memory use stays flat.
+def iter_export(types, updated_since=None, chunk_size=EXPORT_CHUNK_SIZE):
+    for entity_type in types:
+        name, model = ENTITY_TYPES[entity_type]
+        query = db.session.query(*model.__table__.columns)
+        if updated_since is not None:
+            query = query.filter(model.updated_at >= updated_since)
+
+        for row in query.order_by(model.id).yield_per(chunk_size):
+            record = row._asdict()
+            record['type'] = name
+            yield json.dumps(record, default=_default) + '\n'
+
+# Columns every imported record must provide, besides an optional id
+IMPORT_FIELDS = {
+    'actors': ('name', 'age', 'gender'),
+    'movies': ('title', 'release_date'),
+    'movieroles': ('actor_id', 'movie_id')
+}
+
+def read_records(path):
+    with open(path, newline='') as source:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+def _convert(column, value):
+    if value is None or value == '':
+        return None
+
+    python_type = column.type.python_type
+    if python_type is datetime and not isinstance(value, datetime):
+        return datetime.fromisoformat(value)
+    if python_type is int:
+        return int(value)
+    return value
+
+# Loads actors, movies and movie roles from CSV or NDJSON files in batches of
+# `batch_size` rows, each committed on its own. Progress is recorded in the
+# checkpoint file after every batch so a failed import can be rerun and will
+# skip the rows that were already committed.
+class CatalogImporter:
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, checkpoint_path=None, log=sys.stderr):
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.log = log
+        self.checkpoint = {}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint:
+                self.checkpoint = json.load(checkpoint)
+
+    def run(self, sources):
+        for entity_type, path in sources:
+            self.import_file(entity_type, path)
+
+    def import_file(self, entity_type, path):
+        model = ENTITY_TYPES[entity_type][1]
+        done = self.checkpoint.get(path, 0)
+        imported = rejected = 0
+        started = time.monotonic()
+
+        batch = []
+        for position, record in enumerate(read_records(path)):
+            if position < done:
+                continue
+
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                counts = self._import_batch(entity_type, model, batch)
+                imported, rejected = imported + counts[0], rejected + counts[1]
+                self._save_checkpoint(path, position + 1)
+                self._report(entity_type, imported, rejected, started)
+                batch = []
+
+        if batch:
+            counts = self._import_batch(entity_type, model, batch)
+            imported, rejected = imported + counts[0], rejected + counts[1]
+            self._save_checkpoint(path, done + imported + rejected)
+
+        self._report(entity_type, imported, rejected, started)
+        if imported:
+            self._sync_sequence(model.__table__)
+
+        return imported, rejected
+
+    def _import_batch(self, entity_type, model, records):
+        table = model.__table__
+        fields = IMPORT_FIELDS[entity_type]
+        received = len(records)
+        if entity_type == 'movieroles':
+            records = self._resolve_roles(records)
+
+        rows = {}
+        for record in records:
+            columns = fields + ('id',) if record.get('id') not in (None, '') else fields
+            try:
+                row = tuple(_convert(table.c[column], record.get(column)) for column in columns)
+            except (TypeError, ValueError):
+                continue
+            if None not in row:
+                rows.setdefault(columns, []).append(row)
+
+        try:
+            for columns, values in rows.items():
+                self._write(table, columns, values)
+            mark_changed(db.session, table.name)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+        imported = sum(len(values) for values in rows.values())
+        return imported, received - imported
+
+    # Fills in actor_id/movie_id from actor_name/movie_title when no id is
+    # given and drops roles referencing an actor or movie that does not exist
+    # as well as castings that already exist
+    def _resolve_roles(self, records):
+        references = ((Actor, Actor.name, 'actor_id', 'actor_name'), (Movie, Movie.title, 'movie_id', 'movie_title'))
+        for model, column, key, name in references:
+            names = {record[name] for record in records if record.get(key) in (None, '') and record.get(name)}
+            by_name = {}
+            if names:
+                by_name = dict(db.session.query(column, model.id).filter(column.in_(names)).order_by(model.id.desc()))
+
+            for record in records:
+                if record.get(key) in (None, ''):
+                    record[key] = by_name.get(record.get(name))
+                else:
+                    try:
+                        record[key] = int(record[key])
+                    except (TypeError, ValueError):
+                        record[key] = None
+
+            wanted = {record[key] for record in records if record[key] is not None}
+            existing = set()
+            if wanted:
+                existing = {id for (id,) in db.session.query(model.id).filter(model.id.in_(wanted))}
+            records = [record for record in records if record[key] in existing]
+
+        seen = set()
+        actor_ids = {record['actor_id'] for record in records}
+        if actor_ids:
+            seen = set(db.session.query(MovieRole.actor_id, MovieRole.movie_id).filter(MovieRole.actor_id.in_(actor_ids)))
+
+        unique = []
+        for record in records:
+            if (record['actor_id'], record['movie_id']) not in seen:
+                seen.add((record['actor_id'], record['movie_id']))
+                unique.append(record)
+
+        return unique
+
+    def _write(self, table, columns, rows):
+        if db.session.get_bind().dialect.name == 'postgresql':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor = db.session.connection().connection.cursor()
+            cursor.copy_expert('COPY "{}" ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                table.name, ', '.join(columns)), buffer)
+        else:
+            db.session.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+    # Rows imported with explicit ids leave the id sequence behind on PostgreSQL
+    def _sync_sequence(self, table):
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute("SELECT setval(pg_get_serial_sequence('\"{0}\"', 'id'), "
+                               "COALESCE((SELECT MAX(id) FROM \"{0}\"), 1))".format(table.name))
+            db.session.commit()
+
+    def _save_checkpoint(self, path, position):
+        self.checkpoint[path] = position
+        if self.checkpoint_path:
+            with open(self.checkpoint_path + '.tmp', 'w') as checkpoint:
+                json.dump(self.checkpoint, checkpoint)
+            os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def _report(self, entity_type, imported, rejected, started):
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed > 0 else 0
+        print('{}: {} imported, {} rejected, {:.0f} rows/sec'.format(entity_type, imported, rejected, rate), file=self.log)
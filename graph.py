@@ -0,0 +1,269 @@
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from sqlalchemy import event
+
+from models import db, Actor, Movie, MovieRole, TableVersion
+from metrics import collector
+
+# Edges added or removed since the arrays were built before they are rebuilt
+GRAPH_COMPACT_THRESHOLD = int(os.getenv('GRAPH_COMPACT_THRESHOLD', 50000))
+# Most movies separating two actors that GET /actors/{id}/path/{id} looks for
+GRAPH_MAX_DEPTH = int(os.getenv('GRAPH_MAX_DEPTH', 6))
+
+# One side of the actor-movie graph in compressed sparse row form: the sorted
+# node ids, and for the node at position i its neighbours are
+# targets[offsets[i]:offsets[i + 1]], sorted. Three flat integer arrays take a
+# few bytes per role instead of a Python object each. Edges added or removed
+# since are kept in a small overlay until the arrays are rebuilt.
+class Adjacency:
+    def __init__(self, rows=()):
+        self.ids = array('l')
+        self.offsets = array('l')
+        self.targets = array('l')
+        for source, target in rows:
+            if not self.ids or self.ids[-1] != source:
+                self.ids.append(source)
+                self.offsets.append(len(self.targets))
+            self.targets.append(target)
+        self.offsets.append(len(self.targets))
+
+        self.added = {}
+        self.removed = set()
+        self.changes = 0
+
+    def __len__(self):
+        return len(self.targets) - len(self.removed) + sum(len(targets) for targets in self.added.values())
+
+    def _span(self, source):
+        index = bisect_left(self.ids, source)
+        if index < len(self.ids) and self.ids[index] == source:
+            return self.offsets[index], self.offsets[index + 1]
+        return 0, 0
+
+    def _in_arrays(self, source, target):
+        start, end = self._span(source)
+        index = bisect_left(self.targets, target, start, end)
+        return index < end and self.targets[index] == target
+
+    def neighbours(self, source):
+        start, end = self._span(source)
+        targets = self.targets[start:end]
+        if not self.changes:
+            return targets
+        if self.removed:
+            targets = [target for target in targets if (source, target) not in self.removed]
+        added = self.added.get(source)
+        return list(targets) + list(added) if added else targets
+
+    def add(self, source, target):
+        if (source, target) in self.removed:
+            self.removed.discard((source, target))
+        elif not self._in_arrays(source, target):
+            self.added.setdefault(source, set()).add(target)
+        else:
+            return
+        self.changes += 1
+
+    def remove(self, source, target):
+        added = self.added.get(source)
+        if added and target in added:
+            added.discard(target)
+            if not added:
+                del self.added[source]
+        elif self._in_arrays(source, target):
+            self.removed.add((source, target))
+        else:
+            return
+        self.changes += 1
+
+    # The same edges with the overlay folded into the arrays
+    def compacted(self):
+        sources = sorted(set(self.ids) | set(self.added))
+        return Adjacency((source, target) for source in sources for target in sorted(self.neighbours(source)))
+
+# Actor-movie graph of every MovieRole, kept by each worker with both
+# directions indexed, along with the MovieRole TableVersion it reflects. It is
+# loaded from the database on the first query. Roles this worker adds or
+# deletes are applied when their transaction commits, which also moves the
+# graph to the version that commit made, as long as the graph was at the one
+# before. Any other change of the version, i.e. a write by another worker, has
+# the graph loaded again on the next query.
+class CastingGraph:
+    def __init__(self, compact_threshold=GRAPH_COMPACT_THRESHOLD):
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.actors = Adjacency()
+            self.movies = Adjacency()
+            self.version = None
+
+    def __len__(self):
+        return len(self.actors)
+
+    def add_role(self, actor_id, movie_id):
+        with self._lock:
+            self.actors.add(actor_id, movie_id)
+            self.movies.add(movie_id, actor_id)
+            self._compact()
+
+    def remove_role(self, actor_id, movie_id):
+        with self._lock:
+            self.actors.remove(actor_id, movie_id)
+            self.movies.remove(movie_id, actor_id)
+            self._compact()
+
+    def remove_actor(self, actor_id):
+        with self._lock:
+            for movie_id in list(self.actors.neighbours(actor_id)):
+                self.remove_role(actor_id, movie_id)
+
+    def remove_movie(self, movie_id):
+        with self._lock:
+            for actor_id in list(self.movies.neighbours(movie_id)):
+                self.remove_role(actor_id, movie_id)
+
+    def _compact(self):
+        if self.actors.changes > self.compact_threshold:
+            self.actors = self.actors.compacted()
+            self.movies = self.movies.compacted()
+
+    def _load(self):
+        roles = db.session.query(MovieRole.actor_id, MovieRole.movie_id)
+        self.actors = Adjacency(roles.order_by(MovieRole.actor_id, MovieRole.movie_id).yield_per(10000))
+        self.movies = Adjacency((movie_id, actor_id) for actor_id, movie_id in
+                                roles.order_by(MovieRole.movie_id, MovieRole.actor_id).yield_per(10000))
+
+    # Loads the graph again when the MovieRole version is not the one it
+    # reflects. The version is read before the roles, so a write committed
+    # during the load is loaded again by the next sync.
+    def sync(self):
+        version = TableVersion.get_many(['MovieRole'])[0][1]
+        if version == self.version:
+            return
+
+        with self._lock:
+            if version != self.version:
+                self._load()
+                self.version = version
+
+    # Role changes committed by this worker, and the MovieRole version the
+    # commit made when all of its role writes are among the changes
+    def apply(self, changes, version=None):
+        with self._lock:
+            if self.version is None:
+                return
+            for change, args in changes:
+                change(*args)
+            if version is not None and self.version == version - 1:
+                self.version = version
+
+    def movies_of(self, actor_id):
+        with self._lock:
+            return set(self.actors.neighbours(actor_id))
+
+    # Actors sharing a movie with the actor, with the number of movies shared
+    def co_stars(self, actor_id):
+        counts = Counter()
+        with self._lock:
+            for movie_id in self.actors.neighbours(actor_id):
+                counts.update(self.movies.neighbours(movie_id))
+        counts.pop(actor_id, None)
+        return counts
+
+    # Shortest chain of actor, movie, actor, ... from source to target, found
+    # by a breadth-first search from both ends that always expands the
+    # smaller frontier. None when they are more than max_depth movies apart.
+    def path(self, source, target, max_depth=GRAPH_MAX_DEPTH):
+        if source == target:
+            return [source]
+
+        visited = ({source: None}, {target: None})
+        frontiers = ({source}, {target})
+        with self._lock:
+            for _ in range(max_depth):
+                side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+                seen, other = visited[side], visited[1 - side]
+                frontier = set()
+                for actor_id in frontiers[side]:
+                    for movie_id in self.actors.neighbours(actor_id):
+                        for next_id in self.movies.neighbours(movie_id):
+                            if next_id in seen:
+                                continue
+                            seen[next_id] = (actor_id, movie_id)
+                            if next_id in other:
+                                return self._join(visited, next_id)
+                            frontier.add(next_id)
+                if not frontier:
+                    return None
+                frontiers = (frontier, frontiers[1]) if side == 0 else (frontiers[0], frontier)
+        return None
+
+    @staticmethod
+    def _join(visited, meeting):
+        path = [meeting]
+        node = meeting
+        while visited[0][node] is not None:
+            node, movie_id = visited[0][node]
+            path[:0] = [node, movie_id]
+        node = meeting
+        while visited[1][node] is not None:
+            node, movie_id = visited[1][node]
+            path += [movie_id, node]
+        return path
+
+casting_graph = CastingGraph()
+
+# Roles written through the ORM are collected as they are flushed and applied
+# to the graph only once their transaction commits. Statements that write
+# roles directly must record them with record_roles or record_deletes, or the
+# commit has the graph loaded again.
+def record_roles(session, roles):
+    session.info.setdefault('graph_changes', []).extend((casting_graph.add_role, role) for role in roles)
+    session.info['graph_recorded'] = True
+
+def _deletes(model, ids):
+    remove = casting_graph.remove_actor if model is Actor else casting_graph.remove_movie
+    return [(remove, (id,)) for id in ids]
+
+# Actors or movies deleted along with their roles
+def record_deletes(session, model, ids):
+    session.info.setdefault('graph_changes', []).extend(_deletes(model, ids))
+    session.info['graph_recorded'] = True
+
+@event.listens_for(db.session, 'after_flush')
+def _record_role_changes(session, flush_context):
+    changes = session.info.setdefault('graph_changes', [])
+    for obj in session.new:
+        if isinstance(obj, MovieRole):
+            changes.append((casting_graph.add_role, (obj.actor_id, obj.movie_id)))
+    for obj in session.deleted:
+        if isinstance(obj, MovieRole):
+            changes.append((casting_graph.remove_role, (obj.actor_id, obj.movie_id)))
+        elif isinstance(obj, (Actor, Movie)):
+            changes.extend(_deletes(type(obj), [obj.id]))
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_role_changes(session):
+    changes = session.info.pop('graph_changes', None) or []
+    recorded = session.info.pop('graph_recorded', False)
+    committed = session.info.get('committed') or {}
+    version = committed.get('versions', {}).get('MovieRole')
+    if version is not None and 'MovieRole' in committed.get('direct_tables', ()) and not recorded:
+        version = None
+    if changes or version is not None:
+        casting_graph.apply(changes, version)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_role_changes(session):
+    session.info.pop('graph_changes', None)
+    session.info.pop('graph_recorded', None)
+
+@collector
+def _graph_metrics():
+    return [('graph_roles', 'gauge', 'Movie roles in the co-star graph.', len(casting_graph))]
@@ -0,0 +1,106 @@
+import os
+import json
+import hashlib
+from functools import wraps
+from flask import current_app, make_response, request
+
+from caching import RESPONSE_CACHE_URL, backend_from_url
+from serialization import jsonify
+from metrics import collector
+
+# Defaults to the response cache's store; a redis:// URL lets a retry that
+# lands on another gunicorn worker still be recognised
+IDEMPOTENCY_CACHE_URL = os.getenv('IDEMPOTENCY_CACHE_URL', RESPONSE_CACHE_URL)
+# Seconds a response is kept for retries with the same key
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 24 * 3600))
+# Responses kept by the in-process store, the least recently used going first
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000))
+# Seconds a key stays locked while its first request runs, in case the worker
+# dies before storing the response
+IDEMPOTENCY_LOCK_TTL = int(os.getenv('IDEMPOTENCY_LOCK_TTL', 60))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def _error(status, message):
+    return jsonify({
+        'success': False,
+        'error': status,
+        'message': message
+    }), status
+
+# Replays the stored response when a POST is retried with the same
+# Idempotency-Key header, so a client that lost the response to a timeout can
+# safely send the request again. Keys are scoped to the caller, and a key
+# reused for a different request is rejected. While the first request is
+# still running, retries get a 409. Responses with a 5xx status are not kept,
+# so those requests can be retried for real. Requests without the header are
+# not affected.
+class IdempotencyStore:
+    def __init__(self, backend, ttl=IDEMPOTENCY_TTL, lock_ttl=IDEMPOTENCY_LOCK_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.replays = 0
+
+    @staticmethod
+    def _key(idempotency_key, payload):
+        return 'idempotency:' + hashlib.sha256(json.dumps([payload.get('sub'), idempotency_key]).encode()).hexdigest()
+
+    @staticmethod
+    def _fingerprint():
+        digest = hashlib.sha256(json.dumps([request.method, request.path, request.query_string.decode()]).encode())
+        digest.update(request.get_data())
+        return digest.hexdigest()
+
+    def _replay(self, entry, fingerprint):
+        if entry['fingerprint'] != fingerprint:
+            return _error(422, 'Idempotency-Key was already used for a different request')
+        if 'status' not in entry:
+            return _error(409, 'A request with this Idempotency-Key is still being processed')
+
+        self.replays += 1
+        response = current_app.response_class(entry['body'], status=entry['status'], mimetype=entry['mimetype'])
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def idempotent(self, f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            idempotency_key = request.headers.get('Idempotency-Key', None)
+            if idempotency_key is None:
+                return f(payload, *args, **kwargs)
+            if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return _error(400, 'Idempotency-Key must be 1 to {} characters'.format(IDEMPOTENCY_KEY_MAX_LENGTH))
+
+            key = self._key(idempotency_key, payload)
+            fingerprint = self._fingerprint()
+            if not self.backend.add(key, json.dumps({'fingerprint': fingerprint}), self.lock_ttl):
+                entry = self.backend.get(key)
+                if entry is not None:
+                    return self._replay(json.loads(entry), fingerprint)
+                return _error(409, 'A request with this Idempotency-Key is still being processed')
+
+            try:
+                response = make_response(f(payload, *args, **kwargs))
+            except:
+                self.backend.delete(key)
+                raise
+
+            if response.status_code >= 500 or response.is_streamed:
+                self.backend.delete(key)
+            else:
+                self.backend.set(key, json.dumps({
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'mimetype': response.mimetype,
+                    'body': response.get_data(as_text=True)
+                }), self.ttl)
+            return response
+
+        return wrapper
+
+idempotency_store = IdempotencyStore(backend_from_url(IDEMPOTENCY_CACHE_URL, IDEMPOTENCY_MAX_ENTRIES))
+
+@collector
+def _idempotency_metrics():
+    return [('idempotency_replays_total', 'counter', 'POST responses replayed for a repeated Idempotency-Key.',
+             idempotency_store.replays)]
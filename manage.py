@@ -1,14 +1,55 @@
-from flask_script import Manager
+import sys
+import json
+from flask_script import Manager, Command, Option
 from flask_migrate import Migrate, MigrateCommand
 
 from app import APP
 from models import db
+from stats import stats_cache
+from catalog import iter_export, parse_entity_types, parse_updated_since, CatalogImporter, IMPORT_BATCH_SIZE
 
 migrate = Migrate(APP, db)
 manager = Manager(APP)
 
 manager.add_command('db', MigrateCommand)
 
+@manager.option('-t', '--type', dest='types', default=None, help='Comma separated entity types (actors,movies,movieroles)')
+@manager.option('-s', '--updated-since', dest='updated_since', default=None, help='Only export rows updated since this ISO date')
+@manager.option('-o', '--output', dest='output', default=None, help='File to write to instead of stdout')
+def export(types, updated_since, output):
+    "Export the catalog as NDJSON"
+    lines = iter_export(parse_entity_types(types), parse_updated_since(updated_since))
+    out = open(output, 'w') if output else sys.stdout
+    try:
+        out.writelines(lines)
+    finally:
+        if output:
+            out.close()
+
+class ImportCommand(Command):
+    "Import actors, movies and movie roles from CSV or NDJSON files"
+
+    option_list = (
+        Option('--actors', dest='actors', default=None, help='File of actors (name, age, gender and an optional id)'),
+        Option('--movies', dest='movies', default=None, help='File of movies (title, release_date and an optional id)'),
+        Option('--roles', dest='roles', default=None, help='File of movie roles (actor_id or actor_name, movie_id or movie_title)'),
+        Option('--batch-size', dest='batch_size', type=int, default=IMPORT_BATCH_SIZE, help='Rows per batch'),
+        Option('--checkpoint', dest='checkpoint', default=None, help='File recording progress so a failed import can be resumed')
+    )
+
+    def run(self, actors, movies, roles, batch_size, checkpoint):
+        sources = [(entity_type, path) for entity_type, path in
+                   (('actors', actors), ('movies', movies), ('movieroles', roles)) if path]
+        CatalogImporter(batch_size, checkpoint).run(sources)
+
+manager.add_command('import', ImportCommand())
+
+@manager.command
+def stats():
+    "Recompute the statistics served by GET /stats"
+    snapshot = stats_cache.refresh()
+    print(json.dumps(snapshot['stats'], indent=2))
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+REQUEST_LOG_ENABLED = os.getenv('REQUEST_LOG_ENABLED', 'true').lower() == 'true'
+
+# Upper bounds in seconds of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phases reported in Server-Timing, the logs and /metrics, in that order
+PHASES = ('auth', 'jwks', 'pool', 'db', 'search', 'format', 'serialize')
+
+logger = logging.getLogger('casting_agency.requests')
+
+# Functions registered with collector are called on every scrape of /metrics
+# and return (name, type, help, value) tuples for extra process-wide metrics
+_collectors = []
+
+def collector(f):
+    _collectors.append(f)
+    return f
+
+def _request_timings():
+    if has_app_context():
+        return g.get('timings')
+
+# Adds the time spent in the block to the current request's `name` phase.
+# Outside of a request, e.g. in a background JWKS refresh, it does nothing.
+@contextmanager
+def timed(name):
+    timings = _request_timings()
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - started
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_timings() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _request_timings()
+    if timings is not None and conn.info.get('query_started'):
+        timings['db'] = timings.get('db', 0) + time.perf_counter() - conn.info['query_started'].pop()
+        g.sql_queries += 1
+
+# A failed statement never reaches after_cursor_execute, so its start time is
+# popped here instead of being matched with the next statement's end
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    conn = context.connection
+    if context.statement is None or conn is None or not conn.info.get('query_started'):
+        return
+
+    started = conn.info['query_started'].pop()
+    timings = _request_timings()
+    if timings is not None:
+        timings['db'] = timings.get('db', 0) + time.perf_counter() - started
+        g.sql_queries += 1
+
+# Per-process request metrics for each route, rendered in the Prometheus text
+# format. Every gunicorn worker keeps its own, labelled with its pid.
+class RequestMetrics:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._durations = {}
+        self._phases = {}
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, route, status, duration, timings, queries):
+        key = (method, route, str(status))
+        with self._lock:
+            histogram = self._durations.get(key)
+            if histogram is None:
+                histogram = self._durations[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bisect_left(self.buckets, duration)] += 1
+            histogram[1] += duration
+
+            for phase, seconds in timings.items():
+                self._phases[(method, route, phase)] = self._phases.get((method, route, phase), 0) + seconds
+            self._queries[(method, route)] = self._queries.get((method, route), 0) + queries
+
+    def _labels(self, **labels):
+        labels['pid'] = os.getpid()
+        return '{' + ','.join('{}="{}"'.format(name, value) for name, value in sorted(labels.items())) + '}'
+
+    def render(self):
+        lines = [
+            '# HELP http_request_duration_seconds Time to build the response of a request.',
+            '# TYPE http_request_duration_seconds histogram'
+        ]
+        with self._lock:
+            for (method, route, status), (counts, total) in sorted(self._durations.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    labels = self._labels(method=method, route=route, status=status, le=bound)
+                    lines.append('http_request_duration_seconds_bucket{} {}'.format(labels, cumulative))
+                labels = self._labels(method=method, route=route, status=status)
+                lines.append('http_request_duration_seconds_sum{} {}'.format(labels, total))
+                lines.append('http_request_duration_seconds_count{} {}'.format(labels, cumulative))
+
+            lines.append('# HELP http_request_phase_seconds_total Time spent in each phase of a request.')
+            lines.append('# TYPE http_request_phase_seconds_total counter')
+            for (method, route, phase), seconds in sorted(self._phases.items()):
+                labels = self._labels(method=method, route=route, phase=phase)
+                lines.append('http_request_phase_seconds_total{} {}'.format(labels, seconds))
+
+            lines.append('# HELP http_request_sql_queries_total SQL statements executed by requests.')
+            lines.append('# TYPE http_request_sql_queries_total counter')
+            for (method, route), queries in sorted(self._queries.items()):
+                lines.append('http_request_sql_queries_total{} {}'.format(self._labels(method=method, route=route), queries))
+
+        for f in _collectors:
+            for name, metric_type, description, value in f():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+                lines.append('{}{} {}'.format(name, self._labels(), value))
+
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._durations.clear()
+            self._phases.clear()
+            self._queries.clear()
+
+request_metrics = RequestMetrics()
+
+def server_timing(timings, queries, total):
+    entries = []
+    for phase in PHASES:
+        if phase in timings:
+            entry = '{};dur={:.2f}'.format(phase, timings[phase] * 1000)
+            if phase == 'db':
+                entry += ';desc="{} queries"'.format(queries)
+            entries.append(entry)
+    entries.append('total;dur={:.2f}'.format(total * 1000))
+    return ', '.join(entries)
+
+# Times every request of the app. Each response gets a Server-Timing header,
+# one JSON log line and an observation in the /metrics histograms.
+def init_app(app, metrics=request_metrics, log=REQUEST_LOG_ENABLED):
+    if log and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    @app.before_request
+    def start_timing():
+        g.request_started = time.perf_counter()
+        g.timings = {}
+        g.sql_queries = 0
+
+    @app.after_request
+    def record_timing(response):
+        if 'request_started' not in g:
+            return response
+
+        total = time.perf_counter() - g.request_started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        response.headers['Server-Timing'] = server_timing(g.timings, g.sql_queries, total)
+        metrics.observe(request.method, route, response.status_code, total, g.timings, g.sql_queries)
+
+        if log:
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'route': route,
+                'status': response.status_code,
+                'duration_ms': round(total * 1000, 2),
+                'sql_queries': g.sql_queries,
+                'timings_ms': {phase: round(seconds * 1000, 2) for phase, seconds in g.timings.items()}
+            }))
+        return response
+
+    def get_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', get_metrics)
@@ -0,0 +1,28 @@
+"""add updated_at columns
+
+Revision ID: 3c9a1f5e7d21
+Revises: fb27b3256f10
+Create Date: 2026-10-18 10:12:43.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9a1f5e7d21'
+down_revision = 'fb27b3256f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Actor', 'Movie', 'MovieRole'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+        op.create_index(op.f('ix_{}_updated_at'.format(table)), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('MovieRole', 'Movie', 'Actor'):
+        op.drop_index(op.f('ix_{}_updated_at'.format(table)), table_name=table)
+        op.drop_column(table, 'updated_at')
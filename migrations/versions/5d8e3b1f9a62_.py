@@ -0,0 +1,26 @@
+"""add version columns to Actor and Movie
+
+Revision ID: 5d8e3b1f9a62
+Revises: a2f68c0e5b17
+Create Date: 2026-10-18 16:22:09.418736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8e3b1f9a62'
+down_revision = 'a2f68c0e5b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Actor', 'Movie'):
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in ('Movie', 'Actor'):
+        op.drop_column(table, 'version')
@@ -0,0 +1,33 @@
+"""index MovieRole, Actor.name and Movie.release_date
+
+Revision ID: 7e4b2d9c1a38
+Revises: 3c9a1f5e7d21
+Create Date: 2026-10-18 11:40:17.502964
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4b2d9c1a38'
+down_revision = '3c9a1f5e7d21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Remove duplicate castings, keeping the oldest, so the constraint can be created
+    op.execute('DELETE FROM "MovieRole" WHERE id NOT IN '
+               '(SELECT MIN(id) FROM "MovieRole" GROUP BY actor_id, movie_id)')
+    op.create_unique_constraint('uq_MovieRole_actor_id_movie_id', 'MovieRole', ['actor_id', 'movie_id'])
+    op.create_index(op.f('ix_MovieRole_movie_id'), 'MovieRole', ['movie_id'], unique=False)
+    op.create_index(op.f('ix_Actor_name'), 'Actor', ['name'], unique=False)
+    op.create_index(op.f('ix_Movie_release_date'), 'Movie', ['release_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Movie_release_date'), table_name='Movie')
+    op.drop_index(op.f('ix_Actor_name'), table_name='Actor')
+    op.drop_index(op.f('ix_MovieRole_movie_id'), table_name='MovieRole')
+    op.drop_constraint('uq_MovieRole_actor_id_movie_id', 'MovieRole', type_='unique')
@@ -0,0 +1,29 @@
+"""cascade MovieRole deletes in the database
+
+Revision ID: 9b4c7e2a6d15
+Revises: 5d8e3b1f9a62
+Create Date: 2026-10-18 17:48:31.092657
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b4c7e2a6d15'
+down_revision = '5d8e3b1f9a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # PostgreSQL's default names for the constraints of the initial migration
+    for column, table in (('actor_id', 'Actor'), ('movie_id', 'Movie')):
+        op.drop_constraint('MovieRole_{}_fkey'.format(column), 'MovieRole', type_='foreignkey')
+        op.create_foreign_key('MovieRole_{}_fkey'.format(column), 'MovieRole', table, [column], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    for column, table in (('movie_id', 'Movie'), ('actor_id', 'Actor')):
+        op.drop_constraint('MovieRole_{}_fkey'.format(column), 'MovieRole', type_='foreignkey')
+        op.create_foreign_key('MovieRole_{}_fkey'.format(column), 'MovieRole', table, [column], ['id'])
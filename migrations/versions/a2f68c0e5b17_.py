@@ -0,0 +1,32 @@
+"""add TableVersion
+
+Revision ID: a2f68c0e5b17
+Revises: 7e4b2d9c1a38
+Create Date: 2026-10-18 13:05:52.881390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2f68c0e5b17'
+down_revision = '7e4b2d9c1a38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('TableVersion',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute("INSERT INTO \"TableVersion\" (name, version, updated_at) VALUES "
+               "('Actor', 1, now() at time zone 'utc'), ('Movie', 1, now() at time zone 'utc'), "
+               "('MovieRole', 1, now() at time zone 'utc')")
+
+
+def downgrade():
+    op.drop_table('TableVersion')
@@ -0,0 +1,171 @@
+import os
+import json
+import math
+import time
+import base64
+import binascii
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from flask import abort
+from sqlalchemy import and_, or_, tuple_
+
+from models import on_change
+
+ITEMS_PER_PAGE = int(os.getenv('ITEMS_PER_PAGE', 10))
+MAX_ITEMS_PER_PAGE = int(os.getenv('MAX_ITEMS_PER_PAGE', 100))
+COUNT_CACHE_TTL = float(os.getenv('COUNT_CACHE_TTL', 10))
+COUNT_CACHE_MAX_ENTRIES = int(os.getenv('COUNT_CACHE_MAX_ENTRIES', 1024))
+
+# Caches the result of COUNT queries for `ttl` seconds, keyed by the SQL and
+# bound parameters of the query being counted. Keys include client supplied
+# filter values, so at most `max_entries` counts are kept, least recently
+# used first out. A ttl of 0 disables caching.
+class CountCache:
+    def __init__(self, ttl=COUNT_CACHE_TTL, max_entries=COUNT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query):
+        statement = query.statement
+        params = statement.compile().params
+        return str(statement), repr(sorted(params.items()))
+
+    def count(self, query):
+        query = query.order_by(None)
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return query.count()
+
+        key = self._key(query)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is not None:
+                if now - cached[0] < self.ttl:
+                    self._counts.move_to_end(key)
+                    return cached[1]
+                del self._counts[key]
+
+        total = query.count()
+        with self._lock:
+            self._counts[key] = (now, total)
+            self._counts.move_to_end(key)
+            while self._counts:
+                oldest = next(iter(self._counts.values()))
+                if len(self._counts) <= self.max_entries and now - oldest[0] < self.ttl:
+                    break
+                self._counts.popitem(last=False)
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+count_cache = CountCache()
+
+@on_change
+def _invalidate_counts(tables):
+    count_cache.clear()
+
+def get_per_page(request):
+    per_page = request.args.get('per_page', ITEMS_PER_PAGE, type=int)
+    return max(1, min(per_page, MAX_ITEMS_PER_PAGE))
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValueError('Malformed cursor')
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Malformed cursor')
+
+    decoded = []
+    for column, value in zip(columns, values):
+        python_type = column.type.python_type
+        if value is None and not column.expression.nullable:
+            raise ValueError('Malformed cursor')
+        if value is not None and python_type in (date, datetime):
+            if not isinstance(value, str):
+                raise ValueError('Malformed cursor')
+            value = python_type.fromisoformat(value)
+        elif value is not None and not isinstance(value, python_type):
+            raise ValueError('Malformed cursor')
+        decoded.append(value)
+    return decoded
+
+# NULLs sort after every value in ascending order and before them in
+# descending order, as PostgreSQL does by default, on every database
+def ordering(column, descending):
+    if not column.expression.nullable:
+        return column.desc() if descending else column
+    return column.desc().nullsfirst() if descending else column.asc().nullslast()
+
+# Rows that come after the cursor `values` in the order above. Without
+# nullable columns this is a single row value comparison the index can use.
+def after_cursor(columns, values, descending):
+    if not any(column.expression.nullable for column in columns):
+        keys, values = tuple_(*columns), tuple_(*values)
+        return keys < values if descending else keys > values
+
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        rest = None
+    else:
+        rest = after_cursor(columns[1:], values[1:], descending)
+
+    if value is None:
+        same = column.is_(None) if rest is None else and_(column.is_(None), rest)
+        return or_(same, column.isnot(None)) if descending else same
+
+    following = [column < value if descending else column > value]
+    if rest is not None:
+        following.append(and_(column == value, rest))
+    if column.expression.nullable and not descending:
+        following.append(column.is_(None))
+    return or_(*following)
+
+# Paginates `query` ordered by `columns`, the last of which must be unique.
+# With a `cursor` argument the page starts right after the row the cursor
+# was taken from (keyset pagination), otherwise `page` is used as an offset.
+# Either way the response carries a `next_cursor` for the following page.
+def paginate_query(request, query, columns, descending=False):
+    per_page = get_per_page(request)
+    cursor = request.args.get('cursor', None)
+
+    total = count_cache.count(query)
+    query = query.order_by(*[ordering(column, descending) for column in columns])
+    meta = {'total': total, 'per_page': per_page}
+
+    if cursor is not None:
+        if cursor:
+            try:
+                values = decode_cursor(cursor, columns)
+            except ValueError:
+                abort(400)
+
+            query = query.filter(after_cursor(columns, values, descending))
+
+        items = query.limit(per_page + 1).all()
+
+    else:
+        page = request.args.get('page', 1, type=int)
+        items = []
+        if page >= 1:
+            items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+        meta['page'] = page
+        meta['pages'] = math.ceil(total / per_page)
+
+    meta['next_cursor'] = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        meta['next_cursor'] = encode_cursor([getattr(items[-1], column.key) for column in columns])
+
+    return items, meta
@@ -0,0 +1,56 @@
+import os
+import hashlib
+from functools import wraps
+from flask import current_app, g, has_request_context, _request_ctx_stack
+
+from models import REPLICA_LAG_TOLERANCE, on_change, replica_binds
+from caching import RESPONSE_CACHE_URL, backend_from_url
+
+# Defaults to the response cache's store, so a redis:// URL makes the window
+# hold across all gunicorn workers
+REPLICA_STICKY_URL = os.getenv('REPLICA_STICKY_URL', RESPONSE_CACHE_URL)
+
+# Remembers which clients wrote within the last `window` seconds, keyed by a
+# hash of the token's subject. Those clients keep reading from the primary so
+# they always see their own writes.
+class StickyPrimary:
+    def __init__(self, backend, window=REPLICA_LAG_TOLERANCE):
+        self.backend = backend
+        self.window = window
+
+    @staticmethod
+    def _key(subject):
+        return 'sticky:' + hashlib.sha256(subject.encode()).hexdigest()
+
+    def mark(self, subject):
+        if self.window > 0:
+            self.backend.set(self._key(subject), '1', max(1, int(self.window + 0.5)))
+
+    def is_sticky(self, subject):
+        return self.window > 0 and self.backend.get(self._key(subject)) is not None
+
+sticky_primary = StickyPrimary(backend_from_url(REPLICA_STICKY_URL))
+
+def _subject(payload):
+    return str(payload.get('sub', '')) if payload else ''
+
+# Serves the route from a replica when any are configured, unless the caller
+# wrote recently. Goes between requires_auth and the cache decorators, so
+# ETags are computed from the same replica as the response.
+def read_only(f):
+    @wraps(f)
+    def wrapper(payload, *args, **kwargs):
+        if replica_binds(current_app):
+            g.use_replica = not sticky_primary.is_sticky(_subject(payload))
+        return f(payload, *args, **kwargs)
+
+    return wrapper
+
+@on_change
+def _stick_writer_to_primary(tables):
+    if not has_request_context():
+        return
+
+    payload = getattr(_request_ctx_stack.top, 'current_user', None)
+    if payload:
+        sticky_primary.mark(_subject(payload))
@@ -0,0 +1,237 @@
+import os
+import re
+import time
+import threading
+from bisect import bisect_left
+from itertools import islice
+from datetime import timedelta
+
+from models import db, on_change, Actor, Movie, TableVersion
+from metrics import collector, timed
+
+# Seconds between checks of the TableVersion rows for writes made by other
+# workers. Writes made by this worker are picked up by the next search.
+SEARCH_SYNC_INTERVAL = float(os.getenv('SEARCH_SYNC_INTERVAL', 1))
+# Rows are re-read from this many seconds before the newest updated_at already
+# indexed, to catch transactions that committed after a later one
+SEARCH_SYNC_OVERLAP = float(os.getenv('SEARCH_SYNC_OVERLAP', 60))
+# Matching documents ranked per query, which bounds the cost of very common
+# prefixes such as a single letter
+SEARCH_MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', 500))
+SEARCH_DEFAULT_LIMIT = int(os.getenv('SEARCH_DEFAULT_LIMIT', 10))
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 50))
+
+# Searchable entity types, keyed by the name used in ?type=. The kind is the
+# low bit of the integer key each document is stored under.
+SEARCH_TYPES = {
+    'actors': (0, 'actor', Actor, 'name'),
+    'movies': (1, 'movie', Movie, 'title')
+}
+
+_words = re.compile(r'\w+')
+
+def tokenize(text):
+    return _words.findall(text.lower())
+
+def parse_search_types(value):
+    if not value:
+        return list(SEARCH_TYPES)
+
+    types = [search_type.strip() for search_type in value.split(',') if search_type.strip()]
+    for search_type in types:
+        if search_type not in SEARCH_TYPES:
+            raise ValueError('Unknown search type ' + search_type)
+    return types
+
+# Prefix index over actor names and movie titles. Every distinct word is kept
+# in a sorted list, so the words starting with a prefix are found with one
+# bisect and are contiguous, and each word maps to the keys of the documents
+# containing it. Keys are id * 2 + kind, plain ints rather than tuples, to keep
+# the index small with millions of documents.
+#
+# Each worker keeps its own index. It is built from the database on the first
+# search, then caught up with the rows whose updated_at moved whenever the
+# TableVersion rows change. Deleted rows are dropped when a search returns
+# them, as results are always read back from the database.
+class SearchIndex:
+    def __init__(self, sync_interval=SEARCH_SYNC_INTERVAL, overlap=SEARCH_SYNC_OVERLAP,
+                 max_candidates=SEARCH_MAX_CANDIDATES):
+        self.sync_interval = sync_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.max_candidates = max_candidates
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.terms = []
+            self.postings = {}
+            self.documents = {}
+            self.versions = None
+            self.synced_until = {}
+            self.checked_at = 0
+            self.stale = True
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _add_words(self, key, text, new_words):
+        for word in set(text.split()):
+            keys = self.postings.get(word)
+            if keys is None:
+                keys = self.postings[word] = set()
+                new_words.append(word)
+            keys.add(key)
+
+    def _remove_words(self, key, text):
+        for word in set(text.split()):
+            keys = self.postings.get(word)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self.postings[word]
+                index = bisect_left(self.terms, word)
+                if index < len(self.terms) and self.terms[index] == word:
+                    del self.terms[index]
+
+    # A bisect insert per new word is cheap for a few words, while a build or
+    # a large import is better served by sorting all the words once
+    def _insert_terms(self, new_words):
+        if len(new_words) > 100:
+            self.terms = sorted(self.postings)
+        else:
+            for word in new_words:
+                self.terms.insert(bisect_left(self.terms, word), word)
+
+    # Documents are stored as their lowercased words joined by spaces
+    def _index(self, key, text, new_words):
+        text = ' '.join(tokenize(text))
+        previous = self.documents.get(key)
+        if previous == text:
+            return
+        if previous is not None:
+            self._remove_words(key, previous)
+        self.documents[key] = text
+        self._add_words(key, text, new_words)
+
+    def add(self, key, text):
+        with self._lock:
+            new_words = []
+            self._index(key, text, new_words)
+            self._insert_terms(new_words)
+
+    def remove(self, key):
+        with self._lock:
+            previous = self.documents.pop(key, None)
+            if previous is not None:
+                self._remove_words(key, previous)
+
+    # Keys of the documents with a word starting with prefix, exact matches
+    # first since they sort before the longer words
+    def _candidates(self, prefix, kinds):
+        index = bisect_left(self.terms, prefix)
+        while index < len(self.terms) and self.terms[index].startswith(prefix):
+            for key in self.postings[self.terms[index]]:
+                if key & 1 in kinds:
+                    yield key
+            index += 1
+
+    # Documents containing every word of the query, the last of which may be
+    # the start of a word as it is still being typed. The complete words are
+    # matched by intersecting their postings, smallest first, and at most
+    # max_candidates matches are ranked: the exact text first, then texts
+    # starting with the query, then shorter texts.
+    def search(self, query, kinds=(0, 1), limit=SEARCH_DEFAULT_LIMIT):
+        words = tokenize(query)
+        if not words:
+            return []
+        phrase = ' '.join(words)
+        *complete, prefix = words
+
+        with self._lock:
+            if complete:
+                postings = sorted((self.postings.get(word, set()) for word in set(complete)), key=len)
+                keys = postings[0]
+                for other in postings[1:]:
+                    keys = keys & other
+                # A space before the prefix, so a substring test of the
+                # stored text finds the words starting with it
+                prefix = ' ' + prefix
+                candidates = (key for key in keys if key & 1 in kinds and prefix in ' ' + self.documents[key])
+            else:
+                candidates = self._candidates(prefix, kinds)
+
+            matches = list(islice(candidates, self.max_candidates))
+            matches.sort(key=lambda key: (-(self.documents[key] == phrase), -self.documents[key].startswith(phrase),
+                                          len(self.documents[key]), key))
+            return matches[:limit]
+
+    def _load(self, kind, model, column, since=None):
+        query = db.session.query(model.id, getattr(model, column), model.updated_at)
+        if since is not None:
+            query = query.filter(model.updated_at >= since - self.overlap)
+
+        new_words = []
+        newest = self.synced_until.get(kind)
+        for id, text, updated_at in query.yield_per(10000):
+            self._index(id * 2 + kind, text, new_words)
+            if newest is None or updated_at > newest:
+                newest = updated_at
+        self._insert_terms(new_words)
+        self.synced_until[kind] = newest
+
+    # Checks the TableVersion rows at most every sync_interval seconds, or at
+    # once after a local write, and reads the rows that changed since the
+    # last sync. The versions are read first so a write committed during the
+    # sync is seen again by the next one.
+    def sync(self):
+        if not self.stale and time.monotonic() - self.checked_at < self.sync_interval:
+            return
+
+        with self._lock:
+            self.stale = False
+            self.checked_at = time.monotonic()
+            versions = TableVersion.get_many([model.__tablename__ for _, _, model, _ in SEARCH_TYPES.values()])
+            versions = [version for _, version, _ in versions]
+            if versions == self.versions:
+                return
+
+            for kind, _, model, column in SEARCH_TYPES.values():
+                self._load(kind, model, column, self.synced_until.get(kind) if self.versions is not None else None)
+            self.versions = versions
+
+    # Reads the current text of the ranked keys back from the database, so
+    # results never show rows deleted or renamed since they were indexed
+    def results(self, keys):
+        rows = {}
+        for kind, name, model, column in SEARCH_TYPES.values():
+            ids = [key // 2 for key in keys if key & 1 == kind]
+            if ids:
+                for id, text in db.session.query(model.id, getattr(model, column)).filter(model.id.in_(ids)):
+                    self.add(id * 2 + kind, text)
+                    rows[id * 2 + kind] = {'type': name, 'id': id, column: text}
+
+        for key in keys:
+            if key not in rows:
+                self.remove(key)
+        return [rows[key] for key in keys if key in rows]
+
+    # Ranks twice the number of documents asked for, so rows deleted since
+    # they were indexed seldom leave a short page
+    def find(self, query, kinds=(0, 1), limit=SEARCH_DEFAULT_LIMIT):
+        self.sync()
+        with timed('search'):
+            keys = self.search(query, kinds, limit * 2)
+        return self.results(keys)[:limit]
+
+search_index = SearchIndex()
+
+@on_change
+def _mark_search_index_stale(tables):
+    if tables & {'Actor', 'Movie'}:
+        search_index.stale = True
+
+@collector
+def _search_metrics():
+    return [('search_index_documents', 'gauge', 'Actors and movies in the search index.', len(search_index))]
@@ -0,0 +1,73 @@
+import os
+import json
+from datetime import date
+from flask import current_app
+from werkzeug.http import http_date
+
+from metrics import timed
+
+# 'auto' uses orjson when it is installed and the stdlib encoder otherwise
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+
+def _default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    raise TypeError(repr(value) + ' is not JSON serializable')
+
+class StdlibJSONBackend:
+    name = 'stdlib'
+
+    def dumps(self, value, sort_keys=False):
+        return json.dumps(value, default=_default, sort_keys=sort_keys, ensure_ascii=False, separators=(',', ':')).encode()
+
+# Serializes straight to bytes. Dates are passed through to _default so both
+# backends produce the same output.
+class OrjsonBackend:
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, value, sort_keys=False):
+        option = self._orjson.OPT_PASSTHROUGH_DATETIME | self._orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= self._orjson.OPT_SORT_KEYS
+        return self._orjson.dumps(value, default=_default, option=option)
+
+BACKENDS = {
+    'stdlib': StdlibJSONBackend,
+    'orjson': OrjsonBackend
+}
+
+def backend_from_name(name):
+    if name == 'auto':
+        try:
+            return OrjsonBackend()
+        except ImportError:
+            return StdlibJSONBackend()
+
+    if name not in BACKENDS:
+        raise ValueError('Unknown JSON backend ' + name)
+    return BACKENDS[name]()
+
+def init_app(app, backend=None):
+    if backend is None:
+        backend = backend_from_name(app.config.get('JSON_BACKEND', JSON_BACKEND))
+    app.extensions['json_backend'] = backend
+    return backend
+
+# Drop-in replacement for flask.jsonify that encodes with the backend set up
+# by init_app, falling back to the stdlib encoder for apps without one.
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+
+    backend = current_app.extensions.get('json_backend') or StdlibJSONBackend()
+    with timed('serialize'):
+        body = backend.dumps(data, sort_keys=current_app.config['JSON_SORT_KEYS'])
+    return current_app.response_class(body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
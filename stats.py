@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import extract, func
+
+from models import db, Actor, Movie, MovieRole, TableVersion
+from caching import RESPONSE_CACHE_URL, backend_from_url
+
+# Defaults to the response cache's store, so a redis:// URL shares one
+# snapshot between all gunicorn workers
+STATS_CACHE_URL = os.getenv('STATS_CACHE_URL', RESPONSE_CACHE_URL)
+# Least number of seconds between two refreshes of the snapshot
+STATS_REFRESH_INTERVAL = float(os.getenv('STATS_REFRESH_INTERVAL', 60))
+# Width in years of the age histogram buckets
+STATS_AGE_BUCKET = int(os.getenv('STATS_AGE_BUCKET', 10))
+
+STATS_TABLES = ('Actor', 'Movie', 'MovieRole')
+SNAPSHOT_TTL = 30 * 24 * 3600
+
+# Catalog statistics computed with one GROUP BY or COUNT query each, so the
+# database aggregates and only a few rows per breakdown are sent back
+def compute_stats(age_bucket=STATS_AGE_BUCKET):
+    age = Actor.age - Actor.age % age_bucket
+    year = extract('year', Movie.release_date)
+
+    genders = db.session.query(Actor.gender, func.count(Actor.id)).group_by(Actor.gender).order_by(Actor.gender)
+    ages = db.session.query(age, func.count(Actor.id)).filter(Actor.age.isnot(None)).group_by(age).order_by(age)
+    years = db.session.query(year, func.count(Movie.id)).group_by(year).order_by(year)
+    roles = db.session.query(func.count(MovieRole.id)).scalar()
+
+    by_gender = [{'gender': gender, 'count': count} for gender, count in genders]
+    by_release_year = [{'year': int(year), 'count': count} for year, count in years]
+    movies = sum(entry['count'] for entry in by_release_year)
+
+    return {
+        'actors': {
+            'total': sum(entry['count'] for entry in by_gender),
+            'by_gender': by_gender,
+            'by_age': [{'min_age': int(start), 'max_age': int(start) + age_bucket - 1, 'count': count}
+                       for start, count in ages]
+        },
+        'movies': {
+            'total': movies,
+            'by_release_year': by_release_year,
+            'average_cast_size': round(roles / movies, 2) if movies else 0
+        },
+        'movie_roles': {
+            'total': roles
+        }
+    }
+
+# Keeps the last computed statistics with the TableVersion versions they were
+# computed at. Reads are served from the snapshot. Once the versions have
+# moved and the snapshot is at least refresh_interval seconds old, the read
+# that notices starts a refresh in the background and still gets the
+# previous snapshot, marked as stale. `manage.py stats` refreshes it from a
+# scheduler instead.
+class StatsCache:
+    def __init__(self, backend, refresh_interval=STATS_REFRESH_INTERVAL):
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _versions():
+        return [version for _, version, _ in TableVersion.get_many(STATS_TABLES)]
+
+    def refresh(self):
+        versions = self._versions()
+        snapshot = {
+            'versions': versions,
+            'computed_at': time.time(),
+            'stats': compute_stats()
+        }
+        self.backend.set('stats:snapshot', json.dumps(snapshot), SNAPSHOT_TTL)
+        return snapshot
+
+    def _refresh_in_background(self, app):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                with app.app_context():
+                    self.refresh()
+                    db.session.remove()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    # The statistics, when they were computed and whether the catalog has
+    # changed since
+    def get(self):
+        entry = self.backend.get('stats:snapshot')
+        if entry is None:
+            snapshot = self.refresh()
+        else:
+            snapshot = json.loads(entry)
+
+        stale = snapshot['versions'] != self._versions()
+        if stale and time.time() - snapshot['computed_at'] >= self.refresh_interval:
+            self._refresh_in_background(current_app._get_current_object())
+
+        return snapshot['stats'], datetime.utcfromtimestamp(snapshot['computed_at']).isoformat(), stale
+
+stats_cache = StatsCache(backend_from_url(STATS_CACHE_URL))